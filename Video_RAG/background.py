@@ -0,0 +1,173 @@
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import BACKGROUND_IO_WORKERS, BACKGROUND_CPU_WORKERS, JOB_RETENTION_SECONDS
+
+class BackgroundLoop:
+    '''Long-lived event loop on a daemon thread, shared by every Streamlit session of the process'''
+
+    def __init__(self, io_workers=BACKGROUND_IO_WORKERS, cpu_workers=BACKGROUND_CPU_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        # Blocking work runs off the loop: downloads on the io pool, transcription on the cpu pool
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='videorag-io')
+        self.cpu_executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix='videorag-cpu')
+        self.thread = threading.Thread(target=self._run, name='videorag-loop', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        '''Schedule a coroutine on the loop from any thread, returning a concurrent Future'''
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        '''Run a coroutine on the loop and wait for its result from a script thread'''
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, agen):
+        '''Consume an async generator on the loop as a regular generator, e.g. for st.write_stream'''
+        try:
+            while True:
+                try:
+                    yield self.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            # Runs when the consumer stops early too, so the underlying LLM stream is closed
+            self.run(agen.aclose())
+
+    async def run_io(self, func, *args):
+        '''Run blocking I/O such as a download without blocking the loop'''
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, func, *args)
+
+    async def run_cpu(self, func, *args):
+        '''Run CPU heavy work such as transcription on the bounded CPU pool'''
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, func, *args)
+
+class Job:
+    '''Handle to a background job that records progress events for the UI to poll'''
+
+    def __init__(self, key, description=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.description = description
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.future = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._events = []
+        self._lock = threading.Lock()
+
+    def on_progress(self, event):
+        '''Record a progress event, called from the background loop'''
+        # Graph snapshots are large and only useful to in-process callers
+        event = {k: v for k, v in event.items() if k != 'graph'}
+        with self._lock:
+            self._events.append(event)
+
+    def events(self):
+        '''Return the progress events so far, keeping only the latest chunk progress and joining summary tokens'''
+        with self._lock:
+            events = list(self._events)
+        last_chunk = max((i for i, event in enumerate(events) if event['event'] == 'chunk_done'), default=None)
+        compacted = []
+        for i, event in enumerate(events):
+            if event['event'] == 'chunk_done' and i != last_chunk:
+                continue
+            if event['event'] == 'summary_token' and compacted and compacted[-1]['event'] == 'summary_token':
+                compacted[-1] = dict(compacted[-1], token=compacted[-1]['token'] + event['token'])
+                continue
+            compacted.append(event)
+        return compacted
+
+    def done(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def cancel(self):
+        '''Cancel the job if it is still running'''
+        if self.future is not None and self.future.cancel() and self.status == 'queued':
+            # Cancelled before it started, so _run never records it
+            self.status = 'cancelled'
+            self.finished_at = time.time()
+
+    async def _run(self, coro_fn):
+        self.status = 'running'
+        try:
+            self.result = await coro_fn(self.on_progress)
+            self.status = 'done'
+        except asyncio.CancelledError:
+            self.status = 'cancelled'
+        except Exception as e:
+            self.error = e
+            self.status = 'failed'
+            print(f"Background job {self.key} failed: {type(e).__name__}: {e}")
+        finally:
+            self.finished_at = time.time()
+
+class JobRegistry:
+    '''Process-wide registry of background jobs, deduplicated by key across sessions'''
+
+    def __init__(self, background=None, retention=JOB_RETENTION_SECONDS):
+        self.background = background or get_background_loop()
+        self.retention = retention
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, coro_fn, description=None):
+        '''Start coro_fn(on_progress) in the background, or return the unfinished job with the same key'''
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if job.key == key and job.status in ('queued', 'running'):
+                    return job
+            job = Job(key, description)
+            self._jobs[job.id] = job
+        job.future = self.background.submit(job._run(coro_fn))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def find(self, key):
+        '''Return the most recent job with a key, if it is still retained'''
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.key == key]
+        return max(jobs, key=lambda job: job.created_at, default=None)
+
+    def active(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.done()]
+
+    def _prune(self):
+        '''Forget finished jobs older than the retention period'''
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done() and now - job.finished_at > self.retention]:
+            del self._jobs[job_id]
+
+_default_loop = None
+_default_registry = None
+_default_lock = threading.Lock()
+
+def get_background_loop():
+    '''Get the process-wide background event loop'''
+    global _default_loop
+    with _default_lock:
+        if _default_loop is None:
+            _default_loop = BackgroundLoop()
+    return _default_loop
+
+def get_job_registry():
+    '''Get the process-wide background job registry'''
+    global _default_registry
+    background = get_background_loop()
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = JobRegistry(background)
+    return _default_registry
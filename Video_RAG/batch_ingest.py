@@ -0,0 +1,264 @@
+import os
+import sys
+import time
+import socket
+import hashlib
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from storage import VideoStore
+from models import create_llm
+from llm_cache import get_model_name
+from transcribe import transcribe_file
+from video_downloader import get_video_id
+from download_manager import InvalidVideoURLError, VideoUnavailableError, get_download_manager
+from rag_utils import split_transcript, chunk_records
+from graph_rag import execute_rag_summarization
+from background import get_background_loop
+from config import JOB_QUEUE_PATH, BATCH_WORKERS, JOB_MAX_ATTEMPTS
+
+# Stages a job passes through, each checkpointed in the queue and the video store
+STAGES = ('queued', 'downloaded', 'transcribed', 'done')
+
+def get_source_id(source):
+    '''Get the store ID of a YouTube URL or a local audio file'''
+    if os.path.exists(source):
+        return 'local_' + hashlib.sha256(os.path.abspath(source).encode('utf-8')).hexdigest()[:16]
+    return get_video_id(source)
+
+def get_worker_name():
+    '''Identify this process so jobs left running by a dead process can be recovered'''
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def is_worker_alive(worker):
+    '''Check whether the process that claimed a job is still running on this host'''
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobQueue:
+    '''Persistent SQLite queue of ingestion jobs with per-stage checkpoints'''
+
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_id TEXT UNIQUE,
+            source TEXT,
+            status TEXT,
+            stage TEXT,
+            audio_path TEXT,
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            worker TEXT,
+            created_at REAL,
+            updated_at REAL)''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_status ON jobs(status)')
+
+    def add(self, source, force=False):
+        '''Queue a source once per video ID, requeueing it if force is set; returns whether it was queued'''
+        video_id = get_source_id(source)
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute('''INSERT OR IGNORE INTO jobs (video_id, source, status, stage, created_at, updated_at)
+                VALUES (?, ?, 'queued', 'queued', ?, ?)''', (video_id, source, now, now))
+            if cursor.rowcount == 0 and force:
+                cursor = self._conn.execute('''UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, updated_at = ?
+                    WHERE video_id = ? AND status != 'running' ''', (now, video_id))
+        return cursor.rowcount > 0
+
+    def claim(self, worker):
+        '''Atomically take the oldest queued job for a worker, or None when the queue is empty'''
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self._conn.execute('''UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, updated_at = ?
+                        WHERE id = ?''', (worker, time.time(), row['id']))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return dict(row) if row is not None else None
+
+    def checkpoint(self, job_id, stage, **fields):
+        '''Record that a job finished a stage'''
+        fields = dict(fields, stage=stage, updated_at=time.time())
+        if stage == 'done':
+            fields.update(status='done', error=None)
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+
+    def fail(self, job_id, error, retry=True, max_attempts=JOB_MAX_ATTEMPTS):
+        '''Requeue a failed job, or mark it failed once it is out of attempts or not retryable'''
+        with self._lock:
+            self._conn.execute('''UPDATE jobs SET status = CASE WHEN ? AND attempts < ? THEN 'queued' ELSE 'failed' END,
+                error = ?, updated_at = ? WHERE id = ?''', (retry, max_attempts, str(error), time.time(), job_id))
+
+    def recover(self):
+        '''Requeue running jobs whose worker process died, returning how many were recovered'''
+        with self._lock:
+            rows = self._conn.execute("SELECT id, worker FROM jobs WHERE status = 'running'").fetchall()
+            stale = [row['id'] for row in rows if not is_worker_alive(row['worker'])]
+            self._conn.executemany("UPDATE jobs SET status = 'queued', attempts = attempts - 1 WHERE id = ?", [(job_id,) for job_id in stale])
+        return len(stale)
+
+    def jobs(self):
+        '''Return every job, oldest first'''
+        with self._lock:
+            return [dict(row) for row in self._conn.execute('SELECT * FROM jobs ORDER BY id')]
+
+    def counts(self):
+        '''Return the number of jobs per status'''
+        with self._lock:
+            return dict(self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+class BatchWorker:
+    '''Run queued jobs through download, transcription and graph construction on a thread pool'''
+
+    def __init__(self, llm, queue, store=None, workers=BATCH_WORKERS):
+        self.llm = llm
+        self.queue = queue
+        self.store = store or VideoStore()
+        self.workers = workers
+        self.model_name = get_model_name(llm)
+        self.worker_name = get_worker_name()
+        # Transcription saturates the CPU on its own, so only one runs at a time
+        self._transcription_lock = threading.Lock()
+
+    def process(self, job):
+        '''Run the stages a job has not finished yet, resuming from the stored artifacts'''
+        video_id, source = job['video_id'], job['source']
+
+        video_text = self.store.load_transcript(video_id)
+        segments = self.store.load_segments(video_id)
+        if video_text is None:
+            audio_file = job['audio_path'] if job['audio_path'] and os.path.exists(job['audio_path']) else None
+            if audio_file is None:
+                audio_file = source if os.path.exists(source) else get_download_manager().get_audio(source)
+                self.queue.checkpoint(job['id'], 'downloaded', audio_path=audio_file)
+
+            with self._transcription_lock:
+                transcript = transcribe_file(audio_file)
+            video_text, segments = transcript['text'], transcript['segments']
+            self.store.save_transcript(video_id, video_text, segments=segments)
+        self.queue.checkpoint(job['id'], 'transcribed')
+
+        if self.store.load_graph(video_id, model=self.model_name) is None:
+            failed = []
+            def on_progress(event):
+                if event['event'] == 'chunk_failed':
+                    failed.append(event['chunk_index'])
+            # Every worker runs on the one long-lived loop, the model's async clients are bound to the loop they first ran on
+            summary, graph = get_background_loop().run(execute_rag_summarization(self.llm, video_text, on_progress=on_progress, segments=segments))
+            if failed:
+                # Retrying the job re-extracts only the failed chunks from the checkpoints
+                raise RuntimeError(f"{len(failed)} chunks failed extraction")
+            chunks = chunk_records(split_transcript(video_text, segments))
+            self.store.save_graph(video_id, graph, summary, chunks=chunks, model=self.model_name)
+        self.queue.checkpoint(job['id'], 'done')
+
+    def _work(self):
+        '''Claim and process jobs until the queue is empty'''
+        while (job := self.queue.claim(self.worker_name)) is not None:
+            print(f"[{job['video_id']}] starting from stage '{job['stage']}' (attempt {job['attempts'] + 1})")
+            try:
+                self.process(job)
+                print(f"[{job['video_id']}] done")
+            except (InvalidVideoURLError, VideoUnavailableError) as e:
+                self.queue.fail(job['id'], e, retry=False)
+                print(f"[{job['video_id']}] failed: {e}")
+            except Exception as e:
+                self.queue.fail(job['id'], f"{type(e).__name__}: {e}")
+                print(f"[{job['video_id']}] error: {type(e).__name__}: {e}")
+
+    def run(self):
+        '''Recover jobs from crashed runs and process the queue with the worker pool'''
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"Recovered {recovered} interrupted jobs")
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for future in [pool.submit(self._work) for _ in range(self.workers)]:
+                future.result()
+        return self.queue.counts()
+
+def read_sources(sources, files):
+    '''Collect sources from the command line and from list files, one per line'''
+    sources = list(sources)
+    for path in files or []:
+        with open(path) as f:
+            sources.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return sources
+
+def cmd_add(args):
+    queue = JobQueue(args.queue)
+    added = 0
+    for source in read_sources(args.sources, args.file):
+        try:
+            added += queue.add(source, force=args.force)
+        except ValueError as e:
+            print(f"Skipping {source}: {e}")
+    print(f"Queued {added} jobs")
+
+def get_api_key(model):
+    '''Read the provider API key of a model from the environment'''
+    if 'claude' in model:
+        return os.environ.get('ANTHROPIC_API_KEY')
+    if 'gpt' in model:
+        return os.environ.get('OPENAI_API_KEY')
+    return None
+
+def cmd_run(args):
+    llm = create_llm(args.model, args.api_key or get_api_key(args.model))
+    counts = BatchWorker(llm, JobQueue(args.queue), workers=args.workers).run()
+    print(f"Finished: {counts}")
+
+def cmd_status(args):
+    queue = JobQueue(args.queue)
+    for job in queue.jobs():
+        error = f" - {job['error']}" if job['error'] and job['status'] != 'done' else ''
+        print(f"{job['video_id']:>24} {job['status']:>8} {job['stage']:>12} attempts={job['attempts']}{error}")
+    print(queue.counts())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch ingestion of videos into the VideoRAG store')
+    parser.add_argument('--queue', default=JOB_QUEUE_PATH, help='job queue database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help='queue YouTube URLs or local audio files')
+    add_parser.add_argument('sources', nargs='*')
+    add_parser.add_argument('--file', action='append', help='file with one URL or path per line')
+    add_parser.add_argument('--force', action='store_true', help='requeue finished or failed jobs')
+    add_parser.set_defaults(func=cmd_add)
+
+    run_parser = subparsers.add_parser('run', help='process queued jobs, resuming interrupted ones')
+    run_parser.add_argument('--model', default='llama3.1')
+    run_parser.add_argument('--api-key', default=None, help='defaults to ANTHROPIC_API_KEY or OPENAI_API_KEY for the model provider')
+    run_parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    run_parser.set_defaults(func=cmd_run)
+
+    status_parser = subparsers.add_parser('status', help='show every job and its stage')
+    status_parser.set_defaults(func=cmd_status)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
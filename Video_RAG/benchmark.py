@@ -0,0 +1,239 @@
+import sys
+import time
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.language_models.chat_models import BaseChatModel
+
+class FakeLatencyLLM(BaseChatModel):
+    '''Chat model that answers with canned JSON after a fixed delay'''
+    latency: float = 0.5
+    new_types_per_call: int = 2
+
+    @property
+    def _llm_type(self):
+        return 'fake-latency'
+
+    def _respond(self, messages):
+        '''Return a deterministic response for the prompt'''
+        text = messages[-1].content
+        digest = hashlib.md5(text.encode('utf-8')).hexdigest()
+        if '"entity_types"' in text or 'Entity Types' in text:
+            types = [f"type_{digest[i:i + 6]}" for i in range(self.new_types_per_call)]
+            return json.dumps({'entity_types': types})
+        return 'benchmark_domain'
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+def make_documents(count, words=300):
+    '''Make synthetic transcript chunks'''
+    return [Document(page_content=' '.join(f"word{i}_{j}" for j in range(words))) for i in range(count)]
+
+async def time_entity_type_discovery(llm, doc_splits, mode, rounds):
+    '''Time one entity type discovery run'''
+    from graph_rag import discover_entity_types
+    start = time.perf_counter()
+    entity_types = await discover_entity_types(llm, doc_splits, 'benchmark_domain', mode=mode, rounds=rounds, use_cache=False)
+    return time.perf_counter() - start, len(entity_types)
+
+def bench_entity_types(args):
+    '''Compare entity type discovery modes against a fixed-latency fake LLM'''
+    doc_splits = make_documents(args.chunks)
+    llm = FakeLatencyLLM(latency=args.latency)
+    results = []
+    for mode in ('serial', 'windowed'):
+        elapsed, type_count = asyncio.run(time_entity_type_discovery(llm, doc_splits, mode, args.rounds))
+        results.append({'mode': mode, 'rounds': args.rounds, 'seconds': round(elapsed, 3), 'entity_types': type_count})
+        print(f"{mode:>10}: {elapsed:.2f}s, {type_count} entity types")
+    print(f"Speedup: {results[0]['seconds'] / results[1]['seconds']:.1f}x")
+    return results
+
+def bench_transcription(args):
+    '''Report the real-time factor of each transcription backend on a local audio clip'''
+    from pydub import AudioSegment
+    from transcribe import get_backend
+    duration = AudioSegment.from_file(args.audio_file).duration_seconds
+    results = []
+    for name in args.backends:
+        start = time.perf_counter()
+        backend = get_backend(name, args.model, threads=args.threads)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = backend.transcribe(args.audio_file)
+        elapsed = time.perf_counter() - start
+        results.append({'backend': name, 'load_seconds': round(load_seconds, 2), 'seconds': round(elapsed, 2),
+                        'rtf': round(elapsed / duration, 3), 'characters': len(result['text'])})
+        print(f"{name:>15}: load {load_seconds:.1f}s, transcribe {elapsed:.1f}s for {duration:.1f}s of audio, RTF {elapsed / duration:.3f}")
+    return results
+
+def make_extraction(rng, entities=8):
+    '''Make a random entities and relationships response with awkward characters in its values'''
+    words = ['model', 'gpt-4', 'paris', 'data {set}', 'array[0]', 'o\'brien', 'c++', 'naïve bayes', 'step: one']
+    names = [f"{rng.choice(words)}_{i}" for i in range(entities)]
+    descriptions = ['a plain description', 'uses {braces} and [brackets]', 'contains "quoted" words', 'a line\nbreak', 'tab\tand \\ slash']
+    return {
+        'entities': [{'name': name, 'type': rng.choice(['concept', 'person', 'place']), 'description': rng.choice(descriptions)} for name in names],
+        'relationships': [{'source': rng.choice(names), 'target': rng.choice(names), 'relationship': rng.choice(descriptions),
+                           'strength': rng.randint(1, 10)} for _ in range(entities)],
+    }
+
+def unescape_quotes(text):
+    '''Replace escaped quotes inside strings with bare quotes, as some models emit'''
+    return text.replace('\\"', '"')
+
+JSON_MUTATIONS = {
+    'valid': lambda text, rng: text,
+    'pretty': lambda text, rng: json.dumps(json.loads(text), indent=2),
+    'code_fence': lambda text, rng: f"```json\n{text}\n```",
+    'prose': lambda text, rng: f"Here is the extracted knowledge graph:\n{text}\nLet me know if you need anything else.",
+    'trailing_commas': lambda text, rng: text.replace('}]', '},]').replace('"}', '",}'),
+    'unescaped_quotes': lambda text, rng: unescape_quotes(text),
+    'python_repr': lambda text, rng: repr(json.loads(text)),
+    'truncated': lambda text, rng: text[:rng.randint(len(text) // 2, len(text) - 1)],
+    'random_edits': lambda text, rng: ''.join(c for c in text if rng.random() > 0.01),
+}
+
+def make_json_corpus(size, seed=0):
+    '''Make a fuzz corpus of (mutation, text, expected entity names) from malformed LLM outputs'''
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        extraction = make_extraction(rng)
+        mutation = list(JSON_MUTATIONS)[i % len(JSON_MUTATIONS)]
+        text = JSON_MUTATIONS[mutation](json.dumps(extraction, ensure_ascii=False), rng)
+        # Entities cut off by truncation cannot be recovered
+        expected = [entity['name'] for entity in extraction['entities']
+                    if mutation != 'truncated' or json.dumps(entity, ensure_ascii=False) in text]
+        corpus.append({'mutation': mutation, 'text': text, 'expected': expected})
+    return corpus
+
+def legacy_parse(text):
+    '''The previous parsing path: json.loads, then the regex fallback and a second json.loads'''
+    from rag_utils import extract_json_data
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(extract_json_data(text))
+
+def score_parser(parse, corpus):
+    '''Time a parser over the corpus and measure entity recall per mutation'''
+    scores = {}
+    start = time.perf_counter()
+    for sample in corpus:
+        score = scores.setdefault(sample['mutation'], {'samples': 0, 'errors': 0, 'recall': 0.0})
+        score['samples'] += 1
+        try:
+            parsed = parse(sample['text'])
+            names = {entity.get('name') for entity in parsed.get('entities', []) if isinstance(entity, dict)}
+        except Exception:
+            score['errors'] += 1
+            continue
+        expected = set(sample['expected'])
+        score['recall'] += len(names & expected) / len(expected) if expected else 1.0
+    elapsed = time.perf_counter() - start
+    for score in scores.values():
+        score['recall'] = round(score['recall'] / score['samples'], 3)
+    return elapsed, scores
+
+def bench_json_parser(args):
+    '''Compare the tolerant JSON parser with the legacy regex fallback on a fuzz corpus of malformed outputs'''
+    from tolerant_json import parse_json
+    corpus = make_json_corpus(args.size, args.seed)
+    if args.dump:
+        with open(args.dump, 'w') as f:
+            f.writelines(json.dumps(sample, ensure_ascii=False) + '\n' for sample in corpus)
+
+    results = {}
+    for name, parse in (('legacy', legacy_parse), ('tolerant', parse_json)):
+        elapsed, scores = score_parser(parse, corpus)
+        results[name] = {'seconds': round(elapsed, 3), 'scores': scores}
+        print(f"{name}: {elapsed / len(corpus) * 1e6:.0f}us per output")
+        for mutation, score in scores.items():
+            print(f"  {mutation:>16}: recall {score['recall']:.3f}, errors {score['errors']}/{score['samples']}")
+    return results
+
+def make_graph(nodes, edges, seed=0):
+    '''Build a random knowledge graph with skewed degrees with relationship strengths'''
+    import networkx as nx
+    rng = random.Random(seed)
+    graph = nx.Graph()
+    graph.add_nodes_from(f"ENTITY_{i}" for i in range(nodes))
+    pairs = set()
+    while len(pairs) < edges:
+        # Skewed degrees by squaring a uniform draw
+        u, v = int(rng.random() ** 2 * nodes), rng.randrange(nodes)
+        if u != v:
+            pairs.add((min(u, v), max(u, v)))
+    graph.add_edges_from((f"ENTITY_{u}", f"ENTITY_{v}", {'relationship': 'related', 'strength': rng.randint(1, 10)}) for u, v in pairs)
+    return graph
+
+def bench_retrieval(args):
+    '''Time snapshot building, k-hop expansion, personalized PageRank and top-k subgraph extraction'''
+    from graph_index import GraphIndex
+    graph = make_graph(args.nodes, args.edges, args.seed)
+    start = time.perf_counter()
+    index = GraphIndex.from_graph(graph)
+    print(f"snapshot of {args.nodes} nodes / {args.edges} edges: {(time.perf_counter() - start) * 1e3:.0f}ms")
+
+    rng = random.Random(args.seed)
+    queries = [rng.sample(index.names, args.seeds) for _ in range(args.queries)]
+    results = {}
+    for name, run in (('k_hop', lambda seeds: index.k_hop(seeds, args.hops)),
+                      ('pagerank', index.personalized_pagerank),
+                      ('top_k_subgraph', lambda seeds: index.top_k_subgraph(seeds, hops=args.hops))):
+        start = time.perf_counter()
+        for seeds in queries:
+            run(seeds)
+        results[name] = (time.perf_counter() - start) / len(queries) * 1e3
+        print(f"{name:>16}: {results[name]:.2f}ms per query")
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='VideoRAG benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    entity_types_parser = subparsers.add_parser('entity_types', help='entity type discovery latency')
+    entity_types_parser.add_argument('--chunks', type=int, default=20)
+    entity_types_parser.add_argument('--rounds', type=int, default=7)
+    entity_types_parser.add_argument('--latency', type=float, default=0.5, help='simulated seconds per LLM call')
+    entity_types_parser.set_defaults(func=bench_entity_types)
+
+    transcription_parser = subparsers.add_parser('transcription', help='transcription real-time factor per backend')
+    transcription_parser.add_argument('audio_file')
+    transcription_parser.add_argument('--backends', nargs='+', default=['whisper', 'faster_whisper'])
+    transcription_parser.add_argument('--model', default='turbo')
+    transcription_parser.add_argument('--threads', type=int, default=None)
+    transcription_parser.set_defaults(func=bench_transcription)
+
+    json_parser = subparsers.add_parser('json_parser', help='tolerant JSON parser recall and speed on malformed outputs')
+    json_parser.add_argument('--size', type=int, default=900)
+    json_parser.add_argument('--seed', type=int, default=0)
+    json_parser.add_argument('--dump', default=None, help='write the fuzz corpus to a JSONL file')
+    json_parser.set_defaults(func=bench_json_parser)
+
+    retrieval_parser = subparsers.add_parser('retrieval', help='graph retrieval latency on a synthetic graph')
+    retrieval_parser.add_argument('--nodes', type=int, default=20000)
+    retrieval_parser.add_argument('--edges', type=int, default=100000)
+    retrieval_parser.add_argument('--seeds', type=int, default=5, help='seed entities per query')
+    retrieval_parser.add_argument('--hops', type=int, default=2)
+    retrieval_parser.add_argument('--queries', type=int, default=50)
+    retrieval_parser.add_argument('--seed', type=int, default=0)
+    retrieval_parser.set_defaults(func=bench_retrieval)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,121 @@
+import json
+import weakref
+import threading
+from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+from llm_scheduler import get_llm_scheduler, get_provider, estimate_prompt_tokens, estimate_output_tokens
+from llm_cache import get_model_name
+from context_packer import count_tokens
+from tracing import traced
+
+def scheduled(llm, runnable):
+    '''Wrap a model runnable so every call, including each abatch item, goes through the shared scheduler'''
+    provider = get_provider(llm)
+
+    async def call(prompt_value, config=None):
+        prompt_tokens = estimate_prompt_tokens(prompt_value.to_string())
+        tokens = prompt_tokens + estimate_output_tokens(llm)
+        scheduler = get_llm_scheduler()
+        # abatch items share one context, so a per-item parent span comes through the item's config
+        parent = ((config or {}).get('metadata') or {}).get('parent_span')
+        with traced('llm_call', parent=parent, provider=provider, model=get_model_name(llm)) as span:
+            result = await scheduler.run(provider, lambda: runnable.ainvoke(prompt_value), tokens=tokens)
+            scheduler.reconcile(provider, tokens, record_usage(span, result, prompt_tokens))
+        return result
+
+    return RunnableLambda(call)
+
+def record_usage(span, result, prompt_tokens):
+    '''Record the token usage of a model call, estimating it when the provider does not report it; returns the total'''
+    usage = getattr(result, 'usage_metadata', None) or {}
+    prompt_tokens = usage.get('input_tokens') or prompt_tokens
+    completion_tokens = usage.get('output_tokens')
+    if not completion_tokens:
+        text = getattr(result, 'content', result)
+        completion_tokens = count_tokens(text if isinstance(text, str) else json.dumps(text, default=str))
+    span.incr('llm_calls')
+    span.incr('prompt_tokens', prompt_tokens)
+    span.incr('completion_tokens', completion_tokens)
+    return prompt_tokens + completion_tokens
+
+class ChainRegistry:
+    '''Compile each prompt template once and each prompt/model/output mode chain once per model'''
+
+    def __init__(self):
+        self.compiled = 0
+        self.reused = 0
+        self._templates = {}
+        self._chains = {}
+        # Reentrant because a model can be collected, and forgotten, while the lock is held
+        self._lock = threading.RLock()
+
+    def template(self, prompt, input_vars):
+        '''Get the compiled PromptTemplate of a prompt string'''
+        key = (prompt, tuple(sorted(input_vars)))
+        with self._lock:
+            if key not in self._templates:
+                self._templates[key] = PromptTemplate(template=prompt, input_variables=list(key[1]))
+            return self._templates[key]
+
+    def _model_chains(self, llm):
+        '''Get the chains of a model, dropped once the model is garbage collected'''
+        model_key = id(llm)
+        entry = self._chains.get(model_key)
+        if entry is None or entry[0]() is not llm:
+            ref = weakref.ref(llm, lambda _: self._forget(model_key))
+            entry = self._chains[model_key] = (ref, {})
+        return entry[1]
+
+    def _forget(self, model_key):
+        with self._lock:
+            entry = self._chains.get(model_key)
+            if entry is not None and entry[0]() is None:
+                del self._chains[model_key]
+
+    def chain(self, llm, prompt, input_vars, struct=None, isStructuredResponse=False, method='json_schema'):
+        '''Get the chain for a prompt, model and output mode, compiling it on first use'''
+        template = self.template(prompt, input_vars)
+        key = (template.template, tuple(template.input_variables),
+               json.dumps(struct, sort_keys=True, default=str) if isStructuredResponse else None, method if isStructuredResponse else None)
+        with self._lock:
+            chains = self._model_chains(llm)
+            if key in chains:
+                self.reused += 1
+                return chains[key]
+
+            if isStructuredResponse:
+                chain = template | scheduled(llm, llm.with_structured_output(struct, method=method))
+            else:
+                chain = template | scheduled(llm, llm) | StrOutputParser()
+            chains[key] = chain
+            self.compiled += 1
+            return chain
+
+    def stream_chain(self, llm):
+        '''Get the model | StrOutputParser chain used to stream text, scheduled by the caller per stream'''
+        key = ('stream',)
+        with self._lock:
+            chains = self._model_chains(llm)
+            if key in chains:
+                self.reused += 1
+                return chains[key]
+            chain = chains[key] = llm | StrOutputParser()
+            self.compiled += 1
+            return chain
+
+    def stats(self):
+        '''Return how many chains were compiled and reused'''
+        with self._lock:
+            return {'templates': len(self._templates), 'models': len(self._chains), 'compiled': self.compiled, 'reused': self.reused}
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+def get_chain_registry():
+    '''Get the process-wide chain registry'''
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = ChainRegistry()
+    return _default_registry
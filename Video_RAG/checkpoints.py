@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from llm_cache import get_model_name
+from config import CHECKPOINT_PATH, CHECKPOINT_TTL, PIPELINE_VERSION
+
+def make_run_key(llm, doc_splits, mode, prompts=()):
+    '''Identify an extraction run by model, pipeline mode and version, extraction prompts and chunk contents'''
+    digest = hashlib.sha256()
+    digest.update(json.dumps({'model': get_model_name(llm), 'mode': mode, 'version': PIPELINE_VERSION, 'prompts': list(prompts)}, sort_keys=True).encode('utf-8'))
+    for doc in doc_splits:
+        digest.update(hashlib.sha256(doc.page_content.encode('utf-8')).digest())
+    return digest.hexdigest()
+
+class CheckpointStore:
+    '''Persistent SQLite store of per-chunk extraction results so interrupted runs can resume'''
+
+    def __init__(self, path=CHECKPOINT_PATH, ttl=CHECKPOINT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS runs (
+            run_key TEXT PRIMARY KEY,
+            context TEXT,
+            updated_at REAL)''')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS chunks (
+            run_key TEXT,
+            chunk_index INTEGER,
+            status TEXT,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER,
+            updated_at REAL,
+            PRIMARY KEY (run_key, chunk_index))''')
+        self._conn.commit()
+        self.prune()
+
+    def run(self, run_key):
+        '''Get the checkpoint of one extraction run'''
+        return RunCheckpoint(self, run_key)
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+            self._conn.commit()
+        return rows
+
+    def prune(self):
+        '''Drop runs not touched within the TTL'''
+        if self.ttl is None:
+            return
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            self._conn.execute('DELETE FROM chunks WHERE run_key IN (SELECT run_key FROM runs WHERE updated_at < ?)', (cutoff,))
+            self._conn.execute('DELETE FROM runs WHERE updated_at < ?', (cutoff,))
+            self._conn.commit()
+
+class RunCheckpoint:
+    '''Domain, entity types and chunk results of one extraction run'''
+
+    def __init__(self, store, run_key):
+        self.store = store
+        self.run_key = run_key
+
+    def load_context(self):
+        '''Return the saved {domain, entity_types} of the run, or None'''
+        rows = self.store._execute('SELECT context FROM runs WHERE run_key = ?', (self.run_key,))
+        return json.loads(rows[0][0]) if rows and rows[0][0] else None
+
+    def save_context(self, domain, entity_types):
+        '''Save the domain and entity types so a resumed run extracts with the same types'''
+        context = json.dumps({'domain': domain, 'entity_types': entity_types})
+        self.store._execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?)', (self.run_key, context, time.time()))
+
+    def completed(self):
+        '''Return {chunk index: parsed result} for the chunks that already succeeded'''
+        rows = self.store._execute("SELECT chunk_index, result FROM chunks WHERE run_key = ? AND status = 'ok'", (self.run_key,))
+        return {index: json.loads(result) for index, result in rows}
+
+    def failed(self):
+        '''Return {chunk index: error} for the chunks that failed'''
+        rows = self.store._execute("SELECT chunk_index, error FROM chunks WHERE run_key = ? AND status = 'failed'", (self.run_key,))
+        return dict(rows)
+
+    def save(self, index, result):
+        '''Record the parsed result of a chunk as soon as it completes'''
+        self.store._execute('''INSERT INTO chunks VALUES (?, ?, 'ok', ?, NULL, 1, ?)
+            ON CONFLICT(run_key, chunk_index) DO UPDATE SET status = 'ok', result = excluded.result, error = NULL,
+            attempts = attempts + 1, updated_at = excluded.updated_at''', (self.run_key, index, json.dumps(result), time.time()))
+
+    def fail(self, index, error):
+        '''Record that a chunk failed so the next run retries it'''
+        self.store._execute('''INSERT INTO chunks VALUES (?, ?, 'failed', NULL, ?, 1, ?)
+            ON CONFLICT(run_key, chunk_index) DO UPDATE SET status = 'failed', error = excluded.error,
+            attempts = attempts + 1, updated_at = excluded.updated_at''', (self.run_key, index, str(error), time.time()))
+
+    def clear(self):
+        '''Delete every checkpoint of the run'''
+        self.store._execute('DELETE FROM chunks WHERE run_key = ?', (self.run_key,))
+        self.store._execute('DELETE FROM runs WHERE run_key = ?', (self.run_key,))
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_checkpoint_store():
+    '''Get the process-wide checkpoint store'''
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = CheckpointStore()
+    return _default_store
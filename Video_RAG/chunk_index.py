@@ -0,0 +1,71 @@
+import math
+from collections import Counter
+import numpy as np
+from entity_index import tokenize, get_embedder, top_k
+from config import BM25_K1, BM25_B, RRF_K, CHUNK_DENSE_RETRIEVAL, CHUNK_CANDIDATES
+
+class BM25Index:
+    '''Okapi BM25 over an inverted index of term -> (document ids, term frequencies) arrays'''
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        tokenized = [tokenize(document) for document in documents]
+        lengths = np.array([len(tokens) for tokens in tokenized], dtype=np.float32)
+        self.size = len(documents)
+
+        postings = {}
+        for doc_id, tokens in enumerate(tokenized):
+            for term, tf in Counter(tokens).items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(doc_id)
+                tfs.append(tf)
+        self.postings = {term: (np.array(ids, dtype=np.int64), np.array(tfs, dtype=np.float32)) for term, (ids, tfs) in postings.items()}
+        self.idf = {term: math.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5)) for term, (ids, _) in self.postings.items()}
+        # Length normalization of each document, precomputed once
+        average = lengths.mean() if self.size else 0.0
+        self.norm = k1 * (1 - b + b * lengths / max(average, 1e-9))
+
+    def scores(self, query):
+        '''Score every document against a query'''
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                ids, tfs = self.postings[term]
+                scores[ids] += self.idf[term] * tfs * (self.k1 + 1) / (tfs + self.norm[ids])
+        return scores
+
+    def search(self, query, k=10):
+        '''Return the ids of the k best matching documents, best first, skipping documents with no query term'''
+        scores = self.scores(query)
+        return [int(i) for i in top_k(scores, k) if scores[i] > 0]
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    '''Fuse ranked id lists by summing 1 / (k + rank) per id, returning (id, score) pairs best first'''
+    fused = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+class ChunkIndex:
+    '''Hybrid BM25 and dense vector index over the transcript chunks of a video'''
+
+    def __init__(self, chunks, embedder=None, dense=CHUNK_DENSE_RETRIEVAL):
+        # Older stores saved chunks as plain strings
+        self.chunks = [chunk if isinstance(chunk, dict) else {'text': chunk} for chunk in chunks or []]
+        texts = [chunk['text'] for chunk in self.chunks]
+        self.bm25 = BM25Index(texts)
+        self.embedder = (embedder or get_embedder()) if dense else None
+        self.matrix = self.embedder.embed_documents(texts) if self.embedder is not None and texts else None
+
+    def search(self, query, k=CHUNK_CANDIDATES):
+        '''Return the top-k (chunk index, fused score) pairs from keyword and vector rankings'''
+        if not self.chunks:
+            return []
+        # Each ranking is taken deeper than k so fusion can promote chunks both agree on
+        depth = 2 * k
+        rankings = [self.bm25.search(query, depth)]
+        if self.matrix is not None:
+            scores = self.matrix @ self.embedder.embed_query(query)
+            rankings.append(top_k(scores, depth).tolist())
+        return reciprocal_rank_fusion(rankings)[:k]
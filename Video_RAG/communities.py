@@ -0,0 +1,110 @@
+import asyncio
+import networkx as nx
+from rag_utils import generate, generate_text
+from entity_resolution import to_strength
+from query_cache import graph_version
+from context_packer import pack_context
+from config import LLM_CACHE_ENABLED, COMMUNITY_METHOD, COMMUNITY_RESOLUTION, MAX_COMMUNITY_SIZE, MIN_COMMUNITY_SIZE, REDUCE_BATCH_SIZE, COMMUNITY_TOKEN_BUDGET
+from prompt import COMMUNITY_SUMMARY_PROMPT, REDUCE_SUMMARIES_PROMPT
+
+def weighted_graph(graph):
+    '''Copy the graph structure with numeric weights from relationship strength'''
+    weighted = nx.Graph()
+    weighted.add_nodes_from(graph.nodes)
+    for u, v, data in graph.edges(data=True):
+        weighted.add_edge(u, v, weight=(to_strength(data.get('strength')) or 1.0) * data.get('count', 1))
+    return weighted
+
+def partition(graph, method=COMMUNITY_METHOD, resolution=COMMUNITY_RESOLUTION):
+    '''Partition a weighted graph into communities'''
+    if method == 'leiden':
+        try:
+            import igraph as ig
+            import leidenalg
+        except ImportError:
+            raise ImportError("leidenalg and igraph are required for Leiden communities: pip install leidenalg igraph")
+        names = list(graph.nodes)
+        index = {name: i for i, name in enumerate(names)}
+        ig_graph = ig.Graph(n=len(names), edges=[(index[u], index[v]) for u, v in graph.edges])
+        weights = [data['weight'] for _, _, data in graph.edges(data=True)]
+        result = leidenalg.find_partition(ig_graph, leidenalg.RBConfigurationVertexPartition, weights=weights,
+                                          resolution_parameter=resolution, seed=0)
+        return [{names[i] for i in community} for community in result]
+    if method == 'louvain':
+        return nx.community.louvain_communities(graph, weight='weight', resolution=resolution, seed=0)
+    raise ValueError(f"Unknown community method: {method}")
+
+def split_community(graph, community, max_size=MAX_COMMUNITY_SIZE):
+    '''Split an oversized community by partitioning its subgraph, then by fixed-size slices'''
+    if len(community) <= max_size:
+        return [community]
+    parts = partition(graph.subgraph(community))
+    if len(parts) == 1:
+        # Keep the best connected nodes together when the subgraph does not split
+        ordered = sorted(community, key=lambda node: (-graph.degree(node, weight='weight'), node))
+        return [set(ordered[i:i + max_size]) for i in range(0, len(ordered), max_size)]
+    return [piece for part in parts for piece in split_community(graph, part, max_size)]
+
+def detect_communities(graph, method=COMMUNITY_METHOD, max_size=MAX_COMMUNITY_SIZE, min_size=MIN_COMMUNITY_SIZE):
+    '''Detect communities in the knowledge graph, largest first'''
+    if graph.number_of_nodes() == 0:
+        return []
+    weighted = weighted_graph(graph)
+    communities = []
+    small = []
+    for community in partition(weighted, method):
+        if len(community) < min_size:
+            small.extend(sorted(community))
+        else:
+            communities.extend(split_community(weighted, community, max_size))
+
+    # Pool isolated nodes and tiny communities so each does not cost its own summary
+    for i in range(0, len(small), max_size):
+        communities.append(set(small[i:i + max_size]))
+    return sorted((sorted(community) for community in communities), key=len, reverse=True)
+
+def format_community(graph, nodes, token_budget=COMMUNITY_TOKEN_BUDGET):
+    '''Format the entities and relationships of a community as compact lines within a token budget'''
+    return pack_context(graph, token_budget, nodes=nodes)
+
+async def summarize_community(llm, graph, nodes, use_cache=LLM_CACHE_ENABLED):
+    '''Summarize a single community'''
+    entity_list, relationship_list = format_community(graph, nodes)
+    return await generate(llm, COMMUNITY_SUMMARY_PROMPT, {'entity_list': entity_list, 'relationship_list': relationship_list}, use_cache=use_cache)
+
+def cached_communities(graph):
+    '''Return the community summaries stored on the graph, or None if the graph changed since'''
+    cached = graph.graph.get('communities')
+    # A content fingerprint, unlike the in-memory revision, still matches after the graph is stored and loaded
+    if cached and graph.graph.get('communities_version') == graph_version(graph):
+        return cached
+    return None
+
+async def generate_community_summaries(llm, graph, communities=None, use_cache=LLM_CACHE_ENABLED):
+    '''Detect communities, unless given, and summarize them concurrently, caching the result on the graph'''
+    cached = cached_communities(graph)
+    if cached:
+        return cached
+
+    if communities is None:
+        communities = detect_communities(graph)
+    summaries = await asyncio.gather(*[summarize_community(llm, graph, nodes, use_cache=use_cache) for nodes in communities])
+
+    result = []
+    for i, (nodes, summary) in enumerate(zip(communities, summaries)):
+        for node in nodes:
+            graph.nodes[node]['community'] = i
+        result.append({'id': i, 'nodes': nodes, 'summary': summary})
+    graph.graph['communities'] = result
+    graph.graph['communities_version'] = graph_version(graph)
+    print(f"Summarized {len(result)} communities")
+    return result
+
+async def reduce_summaries(llm, summaries, use_cache=LLM_CACHE_ENABLED, batch_size=REDUCE_BATCH_SIZE, on_token=None):
+    '''Merge summaries hierarchically, batch_size at a time, until one remains, streaming the final merge to on_token'''
+    while len(summaries) > 1:
+        batches = [summaries[i:i + batch_size] for i in range(0, len(summaries), batch_size)]
+        final_token = on_token if len(batches) == 1 else None
+        tasks = [generate_text(llm, REDUCE_SUMMARIES_PROMPT, {'community_summaries': '\n\n'.join(batch)}, on_token=final_token, use_cache=use_cache) for batch in batches]
+        summaries = list(await asyncio.gather(*tasks))
+    return summaries[0] if summaries else ''
@@ -0,0 +1,147 @@
+import os
+
+# Directory for all on-disk caches and artifacts
+CACHE_DIR = os.environ.get('VIDEORAG_CACHE_DIR', '.videorag_cache')
+
+# LLM response cache
+LLM_CACHE_ENABLED = os.environ.get('VIDEORAG_LLM_CACHE', '1') != '0'
+LLM_CACHE_PATH = os.path.join(CACHE_DIR, 'llm_cache.db')
+LLM_CACHE_TTL = 7 * 24 * 3600  # seconds, None to keep entries forever
+LLM_CACHE_MAX_ENTRIES = 50000
+
+# LLM scheduler limits per provider (None disables a limit)
+PROVIDER_LIMITS = {
+    'anthropic': {'concurrency': 8, 'requests_per_minute': 50, 'tokens_per_minute': 40000},
+    'openai': {'concurrency': 16, 'requests_per_minute': 500, 'tokens_per_minute': 200000},
+    'ollama': {'concurrency': 2, 'requests_per_minute': None, 'tokens_per_minute': None},
+    'default': {'concurrency': 4, 'requests_per_minute': None, 'tokens_per_minute': None},
+}
+LLM_EXPECTED_OUTPUT_TOKENS = 512  # completion tokens reserved per call until the actual usage is known
+LLM_MAX_RETRIES = 5
+LLM_RETRY_BASE_DELAY = 1.0  # seconds
+LLM_RETRY_MAX_DELAY = 60.0  # seconds
+
+# Structured output: providers listed here get schema-validated JSON through
+# with_structured_output, every other provider is parsed with the tolerant JSON parser
+STRUCTURED_OUTPUT = True
+STRUCTURED_OUTPUT_METHODS = {
+    'openai': 'json_schema',
+    'anthropic': 'function_calling',
+}
+
+# Entity type discovery: 'serial' runs continuation rounds one after another over the
+# whole text and stops early once a round finds nothing new, 'windowed' runs one
+# continuation per disjoint chunk window concurrently and merges the results
+ENTITY_TYPE_DISCOVERY_MODE = 'windowed'
+ENTITY_TYPE_ROUNDS = 7
+
+# Pipeline mode: 'map_reduce' extracts from every chunk and derives the domain and entity
+# types from an evenly spaced sample, 'full_context' only uses the first MAX_CONTEXT_CHUNKS
+PIPELINE_MODE = 'map_reduce'
+MAX_CONTEXT_CHUNKS = 20
+CONTEXT_SAMPLE_CHUNKS = 20
+EXTRACTION_WINDOW = 32  # maximum chunk extractions in flight
+EXTRACTION_BATCH_SIZE = 8  # chunks submitted together through chain.abatch
+EARLY_SUMMARY_FRACTION = None  # fraction of chunks after which a preview summary starts, None to disable
+
+# Per-chunk extraction checkpoints, so a failed or interrupted run resumes where it stopped
+CHECKPOINTS_ENABLED = True
+CHECKPOINT_PATH = os.path.join(CACHE_DIR, 'checkpoints.db')
+CHECKPOINT_TTL = 7 * 24 * 3600  # seconds since a run was last touched
+CHUNK_MAX_RETRIES = 2  # retries of a single chunk when its extraction or parsing fails
+
+# Entity retrieval at query time
+EMBEDDER = 'hashing'  # 'hashing' (no extra dependencies) or 'sentence_transformers'
+EMBEDDING_DIM = 1024
+ENTITY_CANDIDATES = 30  # entities retrieved from the index per query
+SKIP_ENTITY_SELECTION = False  # use the index results directly instead of asking the LLM
+RETRIEVAL_HOPS = 2  # how far from the selected entities query context is gathered
+RETRIEVAL_MAX_NODES = 60  # entities kept by personalized PageRank before packing the query prompt
+PPR_ALPHA = 0.85  # probability a personalized PageRank walk continues instead of restarting at a seed
+PPR_MAX_ITER = 50
+PPR_TOL = 1e-4  # L1 change between iterations; the top ranked entities settle well before this
+CHUNK_CANDIDATES = 8  # transcript chunks retrieved per query alongside the graph context
+CHUNK_DENSE_RETRIEVAL = True  # fuse embedding search with BM25 keyword search over chunks
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60  # reciprocal rank fusion constant
+
+# Semantic cache of chat answers and entity selections, shared by every session
+QUERY_CACHE_ENABLED = True
+QUERY_CACHE_SIMILARITY = 0.9  # cosine similarity above which a cached question is reused; only with a semantic EMBEDDER, the hashing embedder serves exact matches only
+QUERY_CACHE_MAX_ENTRIES = 2000
+
+# Downloaded audio cache, keyed by YouTube video ID with least recently used eviction
+AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, 'audio')
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 ** 3
+DOWNLOAD_CHUNK_BYTES = 1024 ** 2
+DOWNLOAD_TIMEOUT = 30  # seconds per network read
+DOWNLOAD_MAX_RETRIES = 3  # reconnects per download, resuming from the partial file
+PARTIAL_DOWNLOAD_MAX_AGE = 24 * 3600  # seconds before an abandoned partial download is deleted
+
+# Batch ingestion job queue
+JOB_QUEUE_PATH = os.path.join(CACHE_DIR, 'jobs.db')
+BATCH_WORKERS = 4  # videos processed concurrently; transcription runs one at a time
+JOB_MAX_ATTEMPTS = 3
+
+# Per-video artifact storage; bump the versions to rebuild stored artifacts
+VIDEO_STORE_DIR = os.path.join(CACHE_DIR, 'videos')
+TRANSCRIPT_VERSION = 1
+PIPELINE_VERSION = 2
+
+# Entity resolution after graph construction
+ENTITY_RESOLUTION = True
+ENTITY_RESOLUTION_EMBEDDINGS = False  # also merge entities with near-identical embeddings
+ENTITY_NAME_SIMILARITY = 0.8  # character trigram Jaccard similarity of normalized names
+ENTITY_EMBEDDING_SIMILARITY = 0.92  # cosine similarity of name + description embeddings
+LSH_BANDS = 8
+LSH_ROWS = 4
+MAX_BLOCK_SIZE = 50  # LSH buckets larger than this are skipped
+
+# Community detection and summaries
+COMMUNITY_METHOD = 'louvain'  # 'louvain' or 'leiden' (requires leidenalg and igraph)
+COMMUNITY_RESOLUTION = 1.0
+MAX_COMMUNITY_SIZE = 60  # larger communities are split before summarization
+MIN_COMMUNITY_SIZE = 3  # smaller communities are pooled together before summarization
+REDUCE_BATCH_SIZE = 10  # community summaries merged per reduce call
+GLOBAL_QUERY_COMMUNITIES = 10  # community summaries used to answer a global query
+
+# Prompt context budgets (tokens)
+TOKEN_ENCODING = 'cl100k_base'
+MAX_DESCRIPTION_TOKENS = 80  # per entity description
+MAX_SPANS = 3  # time ranges shown per entity or relationship
+SUMMARY_TOKEN_BUDGET = 12000
+COMMUNITY_TOKEN_BUDGET = 4000
+QUERY_TOKEN_BUDGET = 4000
+CHUNK_TOKEN_BUDGET = 1500  # transcript excerpts in the query prompt, on top of QUERY_TOKEN_BUDGET
+
+# Transcription
+TRANSCRIPTION_BACKEND = 'whisper'  # 'whisper' or 'faster_whisper' (int8 CTranslate2 on CPU)
+WHISPER_MODEL = 'turbo'
+TRANSCRIPTION_THREADS = os.cpu_count()
+FASTER_WHISPER_COMPUTE_TYPE = 'int8'
+PARALLEL_TRANSCRIPTION_MIN_SECONDS = 600  # longer audio is split and transcribed in a process pool
+PARALLEL_TRANSCRIPTION_WORKERS = max(1, (os.cpu_count() or 1) // 4)
+PARALLEL_WINDOW_SECONDS = 300
+PARALLEL_OVERLAP_SECONDS = 2
+
+# Streaming download -> transcription -> extraction pipeline
+STREAMING_PIPELINE = False  # process new videos with the overlapped streaming pipeline
+STREAM_SEGMENT_SECONDS = 60  # audio segment length handed to transcription
+STREAM_QUEUE_SIZE = 8  # bounded queue size between stages
+STREAM_CONTEXT_CHUNKS = 5  # first chunks used for the domain and entity types, so extraction starts early
+
+# Transcript chunking
+CHUNK_TOKENS = 400
+
+# Background processing for the Streamlit app
+BACKGROUND_IO_WORKERS = 8  # threads for downloads and other blocking I/O
+BACKGROUND_CPU_WORKERS = 1  # transcriptions run at a time across all sessions
+JOB_POLL_SECONDS = 1.0  # how often the UI refreshes job progress
+JOB_RETENTION_SECONDS = 3600  # finished jobs are kept this long so sessions can pick up their results
+
+# Tracing of pipeline stages and chat turns
+TRACING_ENABLED = True
+TRACE_EXPORTER = 'jsonl'  # 'jsonl' (TRACE_PATH), 'otel' (requires opentelemetry-sdk) or None to only keep spans in memory
+TRACE_PATH = os.path.join(CACHE_DIR, 'traces.jsonl')
+TRACE_BUFFER_SIZE = 10000  # finished spans kept in memory for the summary panel
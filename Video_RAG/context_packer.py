@@ -0,0 +1,134 @@
+import math
+from functools import lru_cache
+import tiktoken
+from entity_resolution import to_strength
+from config import TOKEN_ENCODING, MAX_DESCRIPTION_TOKENS, MAX_SPANS, CHUNK_TOKEN_BUDGET
+
+@lru_cache(maxsize=None)
+def get_encoding(name=TOKEN_ENCODING):
+    '''Get a cached tiktoken encoding'''
+    return tiktoken.get_encoding(name)
+
+def count_tokens(text):
+    '''Count the tokens of a text'''
+    return len(get_encoding().encode(str(text), disallowed_special=()))
+
+def truncate_tokens(text, max_tokens):
+    '''Truncate a text to at most max_tokens tokens'''
+    tokens = get_encoding().encode(str(text), disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return str(text)
+    return get_encoding().decode(tokens[:max_tokens]) + '...'
+
+def format_timestamp(seconds):
+    '''Format seconds as m:ss or h:mm:ss'''
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+def format_spans(spans, max_spans=MAX_SPANS):
+    '''Format the first time spans of an entity or relationship'''
+    if not spans:
+        return ''
+    ranges = ', '.join(f"{format_timestamp(start)}-{format_timestamp(end)}" for start, end in sorted(spans)[:max_spans])
+    return f" @{ranges}"
+
+def entity_line(graph, node):
+    '''Format an entity as a single compact line'''
+    data = graph.nodes[node]
+    description = truncate_tokens(data.get('description') or '', MAX_DESCRIPTION_TOKENS)
+    entity_type = f" [{data['type']}]" if data.get('type') else ''
+    return f"- {node}{entity_type}{format_spans(data.get('spans'))}: {description}"
+
+def relationship_line(u, v, data):
+    '''Format a relationship as a single compact line'''
+    strength = to_strength(data.get('strength'))
+    strength = f" ({strength:g})" if strength is not None else ''
+    return f"- {u} -- {v}{strength}{format_spans(data.get('spans'))}: {data.get('relationship')}"
+
+def chunk_line(chunk):
+    '''Format a transcript chunk as an excerpt with its time range'''
+    if chunk.get('start') is not None and chunk.get('end') is not None:
+        return f"- @{format_timestamp(chunk['start'])}-{format_timestamp(chunk['end'])}: {chunk['text'].strip()}"
+    return f"- {chunk['text'].strip()}"
+
+def pack_chunks(chunks, ranked, token_budget=CHUNK_TOKEN_BUDGET):
+    '''Fill a token budget with the highest ranked chunks, listed in transcript order'''
+    selected = {}
+    used = 0
+    for index in ranked:
+        if used >= token_budget:
+            break
+        line = chunk_line(chunks[index])
+        cost = count_tokens(line) + 1
+        if used + cost > token_budget:
+            if selected:
+                continue
+            # Keep at least the best chunk, cut to the budget
+            line = truncate_tokens(line, token_budget - 1)
+            cost = token_budget
+        selected[index] = line
+        used += cost
+    return '\n'.join(selected[index] for index in sorted(selected))
+
+def default_node_scores(graph, nodes):
+    '''Score nodes by degree, normalized to [0, 1]'''
+    degrees = {node: graph.degree(node) for node in nodes}
+    max_degree = max(degrees.values(), default=0) or 1
+    return {node: degree / max_degree for node, degree in degrees.items()}
+
+def edge_score(data, node_scores, u, v):
+    '''Score an edge by relationship strength, multiplicity and endpoint relevance'''
+    strength = to_strength(data.get('strength')) or 1.0
+    return strength / 10 * (1 + math.log(data.get('count', 1))) + node_scores.get(u, 0) + node_scores.get(v, 0)
+
+def pack_context(graph, token_budget, nodes=None, edges=None, node_scores=None):
+    '''Fill a token budget with the highest ranked entities and relationships as compact lines'''
+    nodes = list(graph.nodes) if nodes is None else [node for node in nodes if node in graph]
+    if edges is None:
+        # Walk the edges in insertion order, a subgraph iterates a node set whose order changes with the hash seed
+        members = set(nodes)
+        edges = [(u, v, data) for u, v, data in graph.edges(nodes, data=True) if u in members and v in members]
+    if node_scores is None:
+        node_scores = default_node_scores(graph, nodes)
+
+    ranked_edges = sorted(((edge_score(data, node_scores, u, v), u, v, data) for u, v, data in edges), key=lambda edge: -edge[0])
+    ranked_nodes = sorted(nodes, key=lambda node: -node_scores.get(node, 0))
+
+    entity_lines = {}
+    relationship_lines = []
+    used = 0
+
+    def add_entity(node):
+        '''Add an entity line once if it fits, returning whether it is included'''
+        nonlocal used
+        if node in entity_lines:
+            return True
+        line = entity_line(graph, node)
+        cost = count_tokens(line) + 1
+        if used + cost > token_budget:
+            return False
+        entity_lines[node] = line
+        used += cost
+        return True
+
+    # Most relevant entities first, then relationships with their endpoints
+    for node in ranked_nodes[:max(1, len(ranked_nodes) // 4)]:
+        if node_scores.get(node, 0) > 0:
+            add_entity(node)
+    for _, u, v, data in ranked_edges:
+        if used >= token_budget:
+            break
+        line = relationship_line(u, v, data)
+        cost = count_tokens(line) + 1
+        if used + cost > token_budget:
+            continue
+        if add_entity(u) and add_entity(v) and used + cost <= token_budget:
+            relationship_lines.append(line)
+            used += cost
+    for node in ranked_nodes:
+        if used >= token_budget:
+            break
+        add_entity(node)
+
+    return '\n'.join(entity_lines.values()), '\n'.join(relationship_lines)
@@ -0,0 +1,195 @@
+import os
+import time
+import threading
+import http.client
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from pytubefix import YouTube
+from pytubefix import exceptions as pytube_exceptions
+from video_downloader import get_video_id
+from config import AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, DOWNLOAD_CHUNK_BYTES, DOWNLOAD_TIMEOUT, DOWNLOAD_MAX_RETRIES, \
+    PARTIAL_DOWNLOAD_MAX_AGE
+
+class DownloadError(Exception):
+    '''Raised when the audio of a video cannot be downloaded'''
+
+class InvalidVideoURLError(DownloadError, ValueError):
+    '''Raised when a URL does not identify a YouTube video'''
+
+class VideoUnavailableError(DownloadError):
+    '''Raised when a video is private, removed, age restricted or live'''
+
+class NetworkError(DownloadError):
+    '''Raised when the transfer keeps failing after every retry'''
+
+def get_audio_stream(url):
+    '''Get the audio-only stream of a YouTube video, mapping pytube errors to download errors'''
+    try:
+        stream = YouTube(url).streams.get_audio_only()
+    except (pytube_exceptions.VideoUnavailable, pytube_exceptions.AgeRestrictedError, pytube_exceptions.LiveStreamError) as e:
+        raise VideoUnavailableError(str(e)) from e
+    except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+        raise NetworkError(f"Could not reach YouTube: {e}") from e
+    except pytube_exceptions.PytubeFixError as e:
+        raise DownloadError(str(e)) from e
+    if stream is None:
+        raise VideoUnavailableError(f"No audio stream available for: {url}")
+    return stream
+
+def fetch_resumable(url, path, total_size=None, on_progress=None, chunk_bytes=DOWNLOAD_CHUNK_BYTES,
+                    timeout=DOWNLOAD_TIMEOUT, max_retries=DOWNLOAD_MAX_RETRIES):
+    '''Download a URL to path, resuming from the bytes already on disk after interruptions'''
+    attempt = 0
+    while True:
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        if total_size and offset >= total_size:
+            return path
+        request = urllib.request.Request(url, headers={'Range': f'bytes={offset}-'} if offset else {})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                # A server that ignores the range sends the whole file again
+                mode = 'ab' if offset and response.status == 206 else 'wb'
+                with open(path, mode) as f:
+                    done = offset if mode == 'ab' else 0
+                    while chunk := response.read(chunk_bytes):
+                        f.write(chunk)
+                        done += len(chunk)
+                        if on_progress:
+                            on_progress(done, total_size)
+            if total_size and os.path.getsize(path) < total_size:
+                raise ConnectionError(f"Connection closed at {os.path.getsize(path)} of {total_size} bytes")
+            return path
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset:
+                # Nothing left to fetch past the partial file
+                return path
+            if e.code in (403, 404, 410):
+                raise VideoUnavailableError(f"Audio stream rejected with HTTP {e.code}") from e
+            error = e
+        except (urllib.error.URLError, http.client.HTTPException, TimeoutError, ConnectionError) as e:
+            error = e
+
+        attempt += 1
+        if attempt > max_retries:
+            raise NetworkError(f"Download failed after {max_retries} retries: {error}") from error
+        print(f"Download interrupted ({error}), resuming (attempt {attempt}/{max_retries})")
+        time.sleep(min(2 ** attempt, 30))
+
+class DownloadManager:
+    '''On-disk audio cache keyed by video ID with single-flight downloads and size-bounded LRU eviction'''
+
+    def __init__(self, root=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _files(self):
+        '''Complete cached audio files as (path, size, last used) tuples'''
+        files = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.endswith('.part') and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def cached_path(self, video_id):
+        '''Return the cached audio file of a video and mark it as recently used, or None'''
+        for name in os.listdir(self.root):
+            if name.startswith(f"{video_id}.") and not name.endswith('.part'):
+                path = os.path.join(self.root, name)
+                os.utime(path)
+                return path
+        return None
+
+    def get_audio(self, url, on_progress=None):
+        '''Return a local audio file for a video, downloading it at most once across concurrent callers'''
+        try:
+            video_id = get_video_id(url)
+        except ValueError as e:
+            raise InvalidVideoURLError(str(e)) from e
+
+        with self._lock:
+            path = self.cached_path(video_id)
+            if path:
+                self.hits += 1
+                return path
+            future = self._inflight.get(video_id)
+            owner = future is None
+            if owner:
+                future = self._inflight[video_id] = Future()
+                self.misses += 1
+
+        # Later callers wait for the download already in flight
+        if not owner:
+            return future.result()
+
+        try:
+            path = self._download(video_id, url, on_progress)
+            self.evict(keep=path)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[video_id]
+
+    def _download(self, video_id, url, on_progress=None):
+        '''Download the audio stream into the cache through a resumable partial file'''
+        stream = get_audio_stream(url)
+        path = os.path.join(self.root, f"{video_id}.{stream.subtype or 'audio'}")
+        part_path = path + '.part'
+        print(f"Downloading audio for {video_id} ({stream.filesize / 1024 ** 2:.1f} MB)")
+        fetch_resumable(stream.url, part_path, total_size=stream.filesize, on_progress=on_progress)
+        os.replace(part_path, path)
+        return path
+
+    def evict(self, keep=None):
+        '''Delete least recently used files over max_bytes and abandoned partial downloads'''
+        with self._lock:
+            inflight = set(self._inflight)
+            now = time.time()
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name.endswith('.part') and name.split('.')[0] not in inflight and now - os.path.getmtime(path) > PARTIAL_DOWNLOAD_MAX_AGE:
+                    os.remove(path)
+
+            files = sorted(self._files(), key=lambda f: f[2])
+            used = sum(size for _, size, _ in files)
+            for path, size, _ in files:
+                if used <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                os.remove(path)
+                used -= size
+
+    def stats(self):
+        '''Return hit/miss counters and the cache size on disk'''
+        files = self._files()
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'files': len(files),
+            'bytes': sum(size for _, size, _ in files),
+        }
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+def get_download_manager():
+    '''Get the process-wide download manager'''
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = DownloadManager()
+    return _default_manager
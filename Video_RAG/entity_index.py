@@ -0,0 +1,126 @@
+import re
+import zlib
+import numpy as np
+from config import EMBEDDER, EMBEDDING_DIM
+
+def tokenize(text):
+    '''Split text into lowercase word tokens'''
+    return re.findall(r'[a-z0-9]+', str(text).lower().replace('_', ' '))
+
+class HashingEmbedder:
+    '''Local embedder that hashes words and character trigrams into a fixed-size vector'''
+    # Similar spelling, not similar meaning: "revenue in 2021" and "revenue in 2022" score above 0.9
+    semantic = False
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def _features(self, text):
+        '''Yield the word and character trigram features of a text'''
+        words = tokenize(text)
+        for word in words:
+            yield word
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3]
+
+    def embed_documents(self, texts):
+        '''Embed a batch of texts into an L2-normalized float32 matrix'''
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                matrix[row, h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def embed_query(self, text):
+        '''Embed a single query'''
+        return self.embed_documents([text])[0]
+
+class LangChainEmbedder:
+    '''Adapter for any langchain Embeddings object, e.g. OllamaEmbeddings'''
+    semantic = True
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts):
+        matrix = np.asarray(self.embeddings.embed_documents(list(texts)), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def embed_query(self, text):
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+class SentenceTransformerEmbedder:
+    '''Local embedder backed by a sentence-transformers model'''
+    semantic = True
+
+    def __init__(self, model_name='all-MiniLM-L6-v2'):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("sentence-transformers is required for this embedder: pip install sentence-transformers")
+        self.model = SentenceTransformer(model_name)
+
+    def embed_documents(self, texts):
+        return np.asarray(self.model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+EMBEDDERS = {
+    'hashing': HashingEmbedder,
+    'sentence_transformers': SentenceTransformerEmbedder,
+}
+
+_embedders = {}
+
+def get_embedder(name=EMBEDDER):
+    '''Get a shared embedder instance by name'''
+    if name not in _embedders:
+        if name not in EMBEDDERS:
+            raise ValueError(f"Unknown embedder: {name}")
+        _embedders[name] = EMBEDDERS[name]()
+    return _embedders[name]
+
+def top_k(scores, k):
+    '''Return the indices of the k highest scores per row, best first'''
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=-1), axis=-1)
+    return np.take_along_axis(idx, order, axis=-1)
+
+class EntityIndex:
+    '''Vector index over entity names and descriptions stored as a NumPy matrix'''
+
+    def __init__(self, names, matrix, embedder):
+        self.names = list(names)
+        self.matrix = matrix
+        self.embedder = embedder
+
+    @classmethod
+    def from_graph(cls, graph, embedder=None):
+        '''Build the index from the nodes of a knowledge graph'''
+        embedder = embedder or get_embedder()
+        names = list(graph.nodes)
+        texts = [f"{name.replace('_', ' ')}: {graph.nodes[name].get('description') or ''}" for name in names]
+        matrix = embedder.embed_documents(texts) if names else np.zeros((0, 1), dtype=np.float32)
+        return cls(names, matrix, embedder)
+
+    def search_batch(self, queries, k=10):
+        '''Return the top-k (name, score) pairs for each query using batched cosine similarity'''
+        if not self.names:
+            return [[] for _ in queries]
+        query_matrix = self.embedder.embed_documents(list(queries))
+        scores = query_matrix @ self.matrix.T
+        indices = top_k(scores, k)
+        return [[(self.names[i], float(scores[row, i])) for i in indices[row]] for row in range(len(queries))]
+
+    def search(self, query, k=10):
+        '''Return the top-k (name, score) pairs for a query'''
+        return self.search_batch([query], k)[0]
@@ -0,0 +1,210 @@
+import re
+import zlib
+import unicodedata
+from collections import defaultdict
+import numpy as np
+import networkx as nx
+from config import ENTITY_NAME_SIMILARITY, ENTITY_EMBEDDING_SIMILARITY, LSH_BANDS, LSH_ROWS, MAX_BLOCK_SIZE
+
+GENERIC_TOKENS = {'the', 'a', 'an', 'model', 'inc', 'corp', 'company', 'mr', 'mrs', 'ms', 'dr'}
+TEXT_ATTRS = ('description', 'relationship')
+MERSENNE_PRIME = (1 << 61) - 1
+
+def normalize_name(name):
+    '''Normalize an entity name so spelling variants map to the same key'''
+    text = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii').lower()
+    tokens = re.findall(r'[a-z0-9]+', text)
+    kept = [token for token in tokens if token not in GENERIC_TOKENS]
+    return ''.join(kept or tokens)
+
+def merge_text(existing, new):
+    '''Merge two descriptions, skipping text that is already contained'''
+    if not new:
+        return existing
+    if not existing:
+        return new
+    existing, new = str(existing), str(new)
+    if new.lower() in existing.lower():
+        return existing
+    if existing.lower() in new.lower():
+        return new
+    separator = ' ' if existing.rstrip().endswith(('.', '!', '?')) else '; '
+    return f"{existing.rstrip()}{separator}{new}"
+
+def to_strength(value):
+    '''Convert a relationship strength to a number, None if invalid'''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def merge_attrs(existing, new):
+    '''Merge node or edge attributes: join texts, average strengths, add counts, union lists'''
+    merged = dict(existing)
+    old_count = existing.get('count', 1)
+    new_count = new.get('count', 1)
+    for key, value in new.items():
+        current = merged.get(key)
+        if key in TEXT_ATTRS:
+            merged[key] = merge_text(current, value)
+        elif key == 'strength':
+            old, add = to_strength(current), to_strength(value)
+            if old is None or add is None:
+                merged[key] = old if add is None else add
+            else:
+                merged[key] = round((old * old_count + add * new_count) / (old_count + new_count), 2)
+        elif key == 'count':
+            continue
+        elif isinstance(current, list) and isinstance(value, list):
+            merged[key] = current + [item for item in value if item not in current]
+        elif current is None:
+            merged[key] = value
+    if 'count' in existing or 'count' in new:
+        merged['count'] = old_count + new_count
+    return merged
+
+def shingles(key, size=3):
+    '''Character shingles of a normalized name'''
+    padded = f"#{key}#"
+    return {padded[i:i + size] for i in range(max(1, len(padded) - size + 1))}
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+class UnionFind:
+    '''Disjoint sets over integer ids'''
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[root_j] = root_i
+
+def minhash_signatures(shingle_sets, num_perm):
+    '''MinHash signatures for a list of shingle sets'''
+    rng = np.random.default_rng(0)
+    a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    signatures = np.empty((len(shingle_sets), num_perm), dtype=np.uint64)
+    for row, shingle_set in enumerate(shingle_sets):
+        hashes = np.array([zlib.crc32(s.encode('utf-8')) for s in shingle_set], dtype=np.uint64)
+        signatures[row] = ((np.outer(hashes, a) + b) % MERSENNE_PRIME).min(axis=0)
+    return signatures
+
+def lsh_candidate_pairs(band_keys):
+    '''Candidate pairs of rows that share a bucket in any band'''
+    pairs = set()
+    for band in range(band_keys.shape[1]):
+        buckets = defaultdict(list)
+        for row, key in enumerate(band_keys[:, band].tolist()):
+            buckets[key].append(row)
+        for rows in buckets.values():
+            # Skip degenerate buckets to stay sub-quadratic
+            if 1 < len(rows) <= MAX_BLOCK_SIZE:
+                pairs.update((rows[i], rows[j]) for i in range(len(rows)) for j in range(i + 1, len(rows)))
+    return pairs
+
+def compatible_types(type_a, type_b):
+    return not type_a or not type_b or type_a == type_b
+
+def resolve_entities(graph, embedder=None, name_threshold=ENTITY_NAME_SIMILARITY, embedding_threshold=ENTITY_EMBEDDING_SIMILARITY):
+    '''Merge duplicate entities by normalized name, MinHash LSH and optional embedding similarity'''
+    names = list(graph.nodes)
+    types = [graph.nodes[name].get('type') for name in names]
+    keys = [normalize_name(name) for name in names]
+    groups = UnionFind(len(names))
+    group_types = list(types)
+
+    def merge(i, j):
+        '''Union two groups unless their types conflict, so an untyped node cannot bridge two typed ones'''
+        root_i, root_j = groups.find(i), groups.find(j)
+        if root_i == root_j:
+            return True
+        if not compatible_types(group_types[root_i], group_types[root_j]):
+            return False
+        groups.union(root_i, root_j)
+        group_types[root_i] = group_types[root_i] or group_types[root_j]
+        return True
+
+    # Exact matches on the normalized name, kept apart when their types differ, e.g. Apple the organization and apple the concept
+    firsts_by_key = defaultdict(list)
+    for i, key in enumerate(keys):
+        firsts = firsts_by_key[key]
+        if not any(merge(j, i) for j in firsts):
+            firsts.append(i)
+
+    # Near-duplicate names, blocked with MinHash LSH over character shingles
+    if len(names) > 1:
+        shingle_sets = [shingles(key) for key in keys]
+        signatures = minhash_signatures(shingle_sets, LSH_BANDS * LSH_ROWS)
+        band_keys = signatures.reshape(len(names), LSH_BANDS, LSH_ROWS)
+        band_keys = np.array([[hash(band.tobytes()) for band in row] for row in band_keys])
+        for i, j in lsh_candidate_pairs(band_keys):
+            if jaccard(shingle_sets[i], shingle_sets[j]) >= name_threshold:
+                merge(i, j)
+
+    # Semantic duplicates, blocked with random hyperplane LSH over embeddings
+    if embedder is not None and len(names) > 1:
+        texts = [f"{name.replace('_', ' ')}: {graph.nodes[name].get('description') or ''}" for name in names]
+        embeddings = embedder.embed_documents(texts)
+        planes = np.random.default_rng(0).standard_normal((embeddings.shape[1], LSH_BANDS * LSH_ROWS)).astype(np.float32)
+        bits = (embeddings @ planes > 0).reshape(len(names), LSH_BANDS, LSH_ROWS)
+        band_keys = np.packbits(bits, axis=-1).reshape(len(names), LSH_BANDS, -1)
+        band_keys = np.array([[hash(band.tobytes()) for band in row] for row in band_keys])
+        for i, j in lsh_candidate_pairs(band_keys):
+            if float(embeddings[i] @ embeddings[j]) >= embedding_threshold:
+                merge(i, j)
+
+    # Pick the best connected name of each group as canonical
+    members = defaultdict(list)
+    for i, name in enumerate(names):
+        members[groups.find(i)].append(name)
+    canonical = {}
+    for group in members.values():
+        best = max(group, key=lambda name: (graph.degree(name), -len(name)))
+        for name in group:
+            canonical[name] = best
+
+    # Rebuild the graph with merged nodes and aggregated edges, under a new revision (see graph_index.mark_changed)
+    resolved = nx.Graph(**graph.graph)
+    resolved.graph['_revision'] = graph.graph.get('_revision', 0) + 1
+    for name in names:
+        target = canonical[name]
+        attrs = dict(graph.nodes[name])
+        if target in resolved:
+            resolved.nodes[target].update(merge_attrs(resolved.nodes[target], attrs))
+        else:
+            resolved.add_node(target, **attrs)
+    merged_edges = 0
+    for u, v, data in graph.edges(data=True):
+        cu, cv = canonical[u], canonical[v]
+        # Drop only the edges between merged duplicates, self-loops the graph already had are kept
+        if cu == cv and u != v:
+            merged_edges += 1
+            continue
+        data = dict(data, count=data.get('count', 1))
+        if resolved.has_edge(cu, cv):
+            merged_edges += 1
+            resolved.edges[cu, cv].update(merge_attrs(resolved.edges[cu, cv], data))
+        else:
+            resolved.add_edge(cu, cv, **data)
+
+    report = {
+        'nodes_before': graph.number_of_nodes(),
+        'nodes_after': resolved.number_of_nodes(),
+        'edges_before': graph.number_of_edges(),
+        'edges_after': resolved.number_of_edges(),
+        'merged_groups': sum(1 for group in members.values() if len(group) > 1),
+        'merged_edges': merged_edges,
+    }
+    print(f"Entity resolution: {report['nodes_before']} -> {report['nodes_after']} nodes, "
+          f"{report['edges_before']} -> {report['edges_after']} edges, {report['merged_groups']} merged groups")
+    return resolved, report
@@ -0,0 +1,129 @@
+import weakref
+import threading
+import numpy as np
+import scipy.sparse as sp
+from entity_resolution import to_strength
+from config import RETRIEVAL_HOPS, RETRIEVAL_MAX_NODES, PPR_ALPHA, PPR_MAX_ITER, PPR_TOL
+
+class GraphIndex:
+    '''Immutable CSR snapshot of a knowledge graph for vectorized multi-hop retrieval'''
+
+    def __init__(self, names, edges, src, dst, weights):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        # Edge list in the graph's order, so selected edges map back to their attributes
+        self.edges = edges
+        self.src = src
+        self.dst = dst
+        self.weights = weights
+
+        n = len(self.names)
+        # Both directions of each undirected edge, parallel entries summed
+        rows = np.concatenate([src, dst])
+        cols = np.concatenate([dst, src])
+        self.adjacency = sp.csr_matrix((np.concatenate([weights, weights]), (rows, cols)), shape=(n, n))
+        self.adjacency.sum_duplicates()
+        out_weight = np.asarray(self.adjacency.sum(axis=1)).ravel()
+        self.dangling = np.flatnonzero(out_weight == 0)
+        # Column-stochastic transition matrix, so a walk step is a single sparse mat-vec
+        inverse = np.divide(1.0, out_weight, out=np.zeros(n), where=out_weight > 0)
+        self.transition = (sp.diags(inverse) @ self.adjacency).T.tocsr()
+        self.pattern = self.adjacency.copy()
+        self.pattern.data[:] = 1.0
+        self.revision = None
+
+    @classmethod
+    def from_graph(cls, graph):
+        '''Snapshot a graph, weighting edges by relationship strength and how often they were extracted'''
+        names = list(graph.nodes)
+        index = {name: i for i, name in enumerate(names)}
+        edges = list(graph.edges(data=True))
+        src = np.fromiter((index[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+        dst = np.fromiter((index[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+        weights = np.fromiter((max(to_strength(data.get('strength')) or 1.0, 1e-3) * data.get('count', 1) for _, _, data in edges),
+                              dtype=np.float64, count=len(edges))
+        return cls(names, edges, src, dst, weights)
+
+    def seed_vector(self, seeds, seed_weights=None):
+        '''Return a probability vector over the seed entities found in the snapshot'''
+        vector = np.zeros(len(self.names))
+        for rank, seed in enumerate(seeds):
+            if seed in self.index:
+                vector[self.index[seed]] += 1.0 if seed_weights is None else seed_weights[rank]
+        total = vector.sum()
+        return vector / total if total > 0 else vector
+
+    def k_hop(self, seeds, hops=RETRIEVAL_HOPS):
+        '''Return the hop distance of every node from the nearest seed, -1 if it is further than hops'''
+        distance = np.full(len(self.names), -1, dtype=np.int64)
+        frontier = self.seed_vector(seeds) > 0
+        distance[frontier] = 0
+        for hop in range(1, hops + 1):
+            if not frontier.any():
+                break
+            reached = (self.pattern @ frontier.astype(np.float64)) > 0
+            frontier = reached & (distance < 0)
+            distance[frontier] = hop
+        return distance
+
+    def personalized_pagerank(self, seeds, alpha=PPR_ALPHA, max_iter=PPR_MAX_ITER, tol=PPR_TOL, seed_weights=None):
+        '''Personalized PageRank from the seeds by power iteration, walks following relationship strength'''
+        restart = self.seed_vector(seeds, seed_weights)
+        if not restart.any():
+            return restart
+        scores = restart.copy()
+        teleport = (1 - alpha) * restart
+        for _ in range(max_iter):
+            # Mass on nodes without edges returns to the seeds
+            updated = self.transition @ (alpha * scores)
+            updated += (alpha * scores[self.dangling].sum()) * restart + teleport
+            converged = np.abs(updated - scores).sum() < tol
+            scores = updated
+            if converged:
+                break
+        return scores
+
+    def top_k_subgraph(self, seeds, k=RETRIEVAL_MAX_NODES, hops=RETRIEVAL_HOPS, seed_weights=None):
+        '''Select the k highest PageRank nodes within hops of the seeds and the edges among them
+
+        Returns ({name: score}, [(u, v, data)]) with seeds always included and edges in descending walk weight.
+        '''
+        distance = self.k_hop(seeds, hops)
+        scores = self.personalized_pagerank(seeds, seed_weights=seed_weights)
+        candidates = np.flatnonzero(distance >= 0)
+        if not len(candidates):
+            return {}, []
+
+        # Seeds first, then the best ranked nodes within reach
+        rank = scores[candidates] + (distance[candidates] == 0) * (scores.max() + 1)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-rank, k - 1)[:k]]
+        selected = np.zeros(len(self.names), dtype=bool)
+        selected[candidates] = True
+
+        edge_ids = np.flatnonzero(selected[self.src] & selected[self.dst])
+        edge_rank = self.weights[edge_ids] * (scores[self.src[edge_ids]] + scores[self.dst[edge_ids]])
+        edge_ids = edge_ids[np.argsort(-edge_rank, kind='stable')]
+        return ({self.names[i]: float(scores[i]) for i in candidates},
+                [self.edges[i] for i in edge_ids.tolist()])
+
+def mark_changed(graph):
+    '''Bump the revision of a graph modified in place, so everything derived from it is rebuilt'''
+    graph.graph['_revision'] = graph.graph.get('_revision', 0) + 1
+
+def graph_revision(graph):
+    '''Identify the state of a graph by its revision, with its size catching edits that skipped mark_changed'''
+    return (graph.graph.get('_revision', 0), graph.number_of_nodes(), graph.number_of_edges())
+
+_snapshots = weakref.WeakKeyDictionary()
+_snapshots_lock = threading.Lock()
+
+def get_graph_index(graph):
+    '''Get the snapshot of a graph, rebuilt when the graph changed since it was taken'''
+    revision = graph_revision(graph)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(graph)
+        if snapshot is None or snapshot.revision != revision:
+            snapshot = _snapshots[graph] = GraphIndex.from_graph(graph)
+            snapshot.revision = revision
+    return snapshot
@@ -1,154 +1,578 @@
-import json
+import time
 import asyncio
 import networkx as nx
-from rag_utils import generate, extract_json_data, split_text
+from rag_utils import generate, generate_text, generate_stream, generate_json, generate_json_batch, split_transcript, split_segments
+from config import LLM_CACHE_ENABLED, ENTITY_TYPE_DISCOVERY_MODE, ENTITY_TYPE_ROUNDS, PIPELINE_MODE, MAX_CONTEXT_CHUNKS, CONTEXT_SAMPLE_CHUNKS, EXTRACTION_WINDOW, EXTRACTION_BATCH_SIZE, EARLY_SUMMARY_FRACTION, CHECKPOINTS_ENABLED, CHUNK_MAX_RETRIES, ENTITY_CANDIDATES, SKIP_ENTITY_SELECTION, ENTITY_RESOLUTION, ENTITY_RESOLUTION_EMBEDDINGS, GLOBAL_QUERY_COMMUNITIES, SUMMARY_TOKEN_BUDGET, QUERY_TOKEN_BUDGET, QUERY_CACHE_ENABLED
+from entity_resolution import resolve_entities, merge_attrs
+from entity_index import get_embedder, top_k
+from communities import detect_communities, cached_communities, generate_community_summaries, reduce_summaries
+from context_packer import pack_context, pack_chunks
+from graph_index import get_graph_index, mark_changed
+from tolerant_json import parse_json
+from checkpoints import get_checkpoint_store, make_run_key
+from query_cache import get_query_cache, query_scope, invalidate_graph
+from tracing import traced, start_span, use_span
 from prompt import *
 
-async def generate_domain(llm, doc_splits):
+# A change to any of these prompts invalidates the extraction checkpoints
+EXTRACTION_PROMPTS = (GENERATE_DOMAIN_PROMPT, ENTITY_TYPE_GENERATION_JSON_PROMPT, ENTITY_TYPE_GENERATION_CONTINUATION_JSON_PROMPT, ENTITY_RELATIONSHIPS_GENERATION_JSON_PROMPT)
+
+async def generate_domain(llm, doc_splits, use_cache=LLM_CACHE_ENABLED):
     '''Generate the domain for the documents'''
     # Generate domain
     docs_text = "\n".join([doc.page_content for doc in doc_splits])
-    domain = await generate(llm, GENERATE_DOMAIN_PROMPT, {'input_text': docs_text})
+    with traced('domain'):
+        domain = await generate(llm, GENERATE_DOMAIN_PROMPT, {'input_text': docs_text}, use_cache=use_cache)
     print(f"Domain: {domain}")
     return domain
 
-async def generate_entity_types(llm, doc_splits, domain):
+async def generate_entity_types(llm, doc_splits, domain, use_cache=LLM_CACHE_ENABLED):
     '''Generate entity types for the documents'''
     # Generate entity types
     doc_text = " ".join([doc.page_content for doc in doc_splits])
-    entity_types = await generate(llm, ENTITY_TYPE_GENERATION_JSON_PROMPT, {'task': DEFAULT_TASK.format(domain=domain), 'input_text': doc_text, 'domain': domain}, struct=None, isStructuredResponse=False)
+    entity_types = await generate_json(llm, ENTITY_TYPE_GENERATION_JSON_PROMPT, {'task': DEFAULT_TASK.format(domain=domain), 'input_text': doc_text, 'domain': domain}, ENTITY_TYPES_SCHEMA, use_cache=use_cache)
     print(f"Entity types: {entity_types}")
-    entity_types = json.loads(entity_types)['entity_types']
+    entity_types = entity_types['entity_types']
     return entity_types
 
-async def generate_entity_types_continuation(llm, doc_splits, domain, entity_types):
+async def generate_entity_types_continuation(llm, doc_splits, domain, entity_types, use_cache=LLM_CACHE_ENABLED):
     '''Generate entity types continuation for the documents'''
     # Generate entity types continuation
     doc_text = " ".join([doc.page_content for doc in doc_splits])
-    entity_types = await generate(llm, ENTITY_TYPE_GENERATION_CONTINUATION_JSON_PROMPT, {'task': DEFAULT_TASK.format(domain=domain), 'input_text': doc_text, 'entity_types': entity_types}, struct=None, isStructuredResponse=False)
+    entity_types = await generate_json(llm, ENTITY_TYPE_GENERATION_CONTINUATION_JSON_PROMPT, {'task': DEFAULT_TASK.format(domain=domain), 'input_text': doc_text, 'entity_types': entity_types}, ENTITY_TYPES_SCHEMA, use_cache=use_cache)
     print(f"Entity types continuation: {entity_types}")
-    entity_types = json.loads(entity_types)['entity_types']
+    entity_types = entity_types['entity_types']
+    return entity_types
+
+def normalize_entity_type(entity_type):
+    '''Normalize an entity type to lowercase with underscores'''
+    return '_'.join(str(entity_type).strip().lower().replace('-', ' ').split())
+
+def merge_entity_types(entity_types, new_entity_types):
+    '''Merge new entity types into the list, skipping duplicates'''
+    merged = list(entity_types)
+    seen = {normalize_entity_type(entity_type) for entity_type in merged}
+    for entity_type in new_entity_types:
+        key = normalize_entity_type(entity_type)
+        if key and key not in seen:
+            seen.add(key)
+            merged.append(key)
+    return merged
+
+def split_windows(doc_splits, window_count):
+    '''Split the documents into contiguous, disjoint windows'''
+    window_count = max(1, min(window_count, len(doc_splits)))
+    window_size = -(-len(doc_splits) // window_count)
+    return [doc_splits[i:i + window_size] for i in range(0, len(doc_splits), window_size)]
+
+async def discover_entity_types(llm, doc_splits, domain, mode=ENTITY_TYPE_DISCOVERY_MODE, rounds=ENTITY_TYPE_ROUNDS, use_cache=LLM_CACHE_ENABLED):
+    '''Discover the entity types for the documents with the configured continuation mode'''
+    with traced('entity_types', mode=mode) as span:
+        entity_types = await generate_entity_types(llm, doc_splits, domain, use_cache=use_cache)
+        entity_types = merge_entity_types([], entity_types)
+
+        if mode == 'serial':
+            # Continue over the whole text until a round finds no new types
+            for i in range(rounds):
+                new_entity_types = await generate_entity_types_continuation(llm, doc_splits, domain, entity_types, use_cache=use_cache)
+                merged = merge_entity_types(entity_types, new_entity_types)
+                if len(merged) == len(entity_types):
+                    print(f"No new entity types after {i + 1} continuation rounds")
+                    break
+                entity_types = merged
+
+        elif mode == 'windowed':
+            # Continue over disjoint windows concurrently and merge the results
+            windows = split_windows(doc_splits, rounds)
+            tasks = [generate_entity_types_continuation(llm, window, domain, entity_types, use_cache=use_cache) for window in windows]
+            for new_entity_types in await asyncio.gather(*tasks):
+                entity_types = merge_entity_types(entity_types, new_entity_types)
+
+        else:
+            raise ValueError(f"Unknown entity type discovery mode: {mode}")
+
+        span.set(entity_types=len(entity_types))
     return entity_types
 
-async def generate_entities_and_relationships(llm, doc_splits, entity_types):   
+def sample_chunks(doc_splits, sample_size=CONTEXT_SAMPLE_CHUNKS):
+    '''Pick evenly spaced chunks so context prompts stay the same size for any video length'''
+    if len(doc_splits) <= sample_size:
+        return doc_splits
+    step = len(doc_splits) / sample_size
+    return [doc_splits[int(i * step)] for i in range(sample_size)]
+
+async def extract_entities_and_relationships(llm, doc, entity_types, use_cache=LLM_CACHE_ENABLED):
+    '''Generate the entities and relationships of a single document split as a dict'''
+    return await generate_json(llm, ENTITY_RELATIONSHIPS_GENERATION_JSON_PROMPT, {'entity_types': entity_types, 'input_text': doc.page_content}, ENTITY_RELATIONSHIPS_SCHEMA, use_cache=use_cache)
+
+async def as_completed_bounded(func, items, window=EXTRACTION_WINDOW):
+    '''Yield the results of func(item) as they complete, keeping at most window in flight'''
+    pending = set()
+    items = iter(items)
+    try:
+        while True:
+            # Top up the in-flight tasks
+            for item in items:
+                pending.add(asyncio.ensure_future(func(item)))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def iter_entities_and_relationships(llm, doc_splits, entity_types, window=EXTRACTION_WINDOW, use_cache=LLM_CACHE_ENABLED):
+    '''Yield (chunk index, extracted data) as each chunk extraction completes, keeping at most window in flight'''
+    async def extract(item):
+        index, doc = item
+        return index, await extract_entities_and_relationships(llm, doc, entity_types, use_cache=use_cache)
+
+    async for result in as_completed_bounded(extract, enumerate(doc_splits), window):
+        yield result
+
+async def extract_chunk(llm, doc, entity_types, use_cache=LLM_CACHE_ENABLED, retries=CHUNK_MAX_RETRIES):
+    '''Extract and parse the entities and relationships of one chunk, retrying the chunk on its own on failure'''
+    with traced('extract_chunk') as span:
+        for attempt in range(retries + 1):
+            span.set(attempts=attempt + 1)
+            try:
+                # A cached response that failed to parse would fail again, so retries bypass the cache
+                eAndr = await extract_entities_and_relationships(llm, doc, entity_types, use_cache=use_cache and attempt == 0)
+                with traced('parse'):
+                    extracted_data = parse_entity_and_relationship(eAndr)
+                if not isinstance(extracted_data, dict):
+                    raise ValueError(f"Expected a JSON object, got {type(extracted_data).__name__}")
+                return extracted_data
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                print(f"WARNING: chunk extraction failed with {type(e).__name__}: {e}, retry {attempt + 1}/{retries}")
+
+async def generate_entities_and_relationships(llm, doc_splits, entity_types, use_cache=LLM_CACHE_ENABLED):   
     '''Generate entities and relationships for the documents'''
     # Generate entities and relationships in parallel for each document split
     entities_and_relationships = []
 
-    tasks = [generate(llm, ENTITY_RELATIONSHIPS_GENERATION_JSON_PROMPT, {'entity_types': entity_types, 'input_text': doc.page_content}, None, isStructuredResponse=False) for doc in doc_splits]
-
-    for task in asyncio.as_completed(tasks):
-        eAndr = await task
+    async for index, eAndr in iter_entities_and_relationships(llm, doc_splits, entity_types, use_cache=use_cache):
         print(eAndr)
         entities_and_relationships.append(eAndr)
         
     return entities_and_relationships
-        
+
+def parse_entity_and_relationship(eAndr):
+    '''Parse the entities and relationships of a single chunk'''
+    return parse_json(eAndr)
+
 def parse_entities_and_relationships(entities_and_relationships):
     '''Parse the entities and relationships'''
     # Parse json data using custom function
     parsed_entities_and_relationships = []
     for eAndr in entities_and_relationships:
-        try:
-            extracted_data = json.loads(eAndr)
-        except:
-            print('WARNING: Could not parse JSON data. Attempting to extract manually...')
-            extracted_data = extract_json_data(eAndr)
-            extracted_data = json.loads(extracted_data)
+        extracted_data = parse_entity_and_relationship(eAndr)
         print(extracted_data)
         parsed_entities_and_relationships.append(extracted_data)
     return parsed_entities_and_relationships
 
+async def extract_chunks(llm, docs, entity_types, use_cache=LLM_CACHE_ENABLED, retries=CHUNK_MAX_RETRIES):
+    '''Extract a batch of chunks with one batched call, retrying failed chunks on their own; returns (data, error) per chunk'''
+    prompt_vals = [{'entity_types': entity_types, 'input_text': doc.page_content} for doc in docs]
+    with traced('extract_batch', chunks=len(docs)) as batch_span:
+        # A span per chunk of the batch, holding its own LLM call, tokens and cache hits
+        spans = [start_span('extract_chunk', parent=batch_span, batched=True, attempts=1, time_span=chunk_span(doc)) for doc in docs]
+        try:
+            responses = await generate_json_batch(llm, ENTITY_RELATIONSHIPS_GENERATION_JSON_PROMPT, prompt_vals, ENTITY_RELATIONSHIPS_SCHEMA, use_cache=use_cache, spans=spans)
+        except BaseException as e:
+            for span in spans:
+                span.end(error=e)
+            raise
+
+        async def settle(doc, response, span):
+            if isinstance(response, dict):
+                span.end()
+                return response, None
+            error = response if isinstance(response, BaseException) else ValueError(f"Expected a JSON object, got {type(response).__name__}")
+            span.end(error=error)
+            if retries == 0:
+                return None, error
+            print(f"WARNING: chunk extraction failed with {type(error).__name__}: {error}, retrying on its own")
+            try:
+                # The batch attempt counts as the first one, so the retries bypass the cache
+                return await extract_chunk(llm, doc, entity_types, use_cache=False, retries=retries - 1), None
+            except Exception as e:
+                return None, e
+
+        return await asyncio.gather(*(settle(doc, response, span) for doc, response, span in zip(docs, responses, spans)))
+
+def chunk_span(doc):
+    '''Get the [start, end] time span of a document split, or None without timestamps'''
+    if doc.metadata.get('start') is None:
+        return None
+    return [round(doc.metadata['start'], 1), round(doc.metadata['end'], 1)]
+
+def add_to_knowledge_graph(graph, eAndr, span=None):
+    '''Merge the parsed entities and relationships of one chunk into the graph'''
+    spans = {'spans': [span]} if span else {}
+    for entity in eAndr.get('entities', []):
+        if not entity.get('name'):
+            continue
+        attrs = dict({'type': entity.get('type'), 'description': entity.get('description')}, **spans)
+        if entity['name'] in graph:
+            graph.nodes[entity['name']].update(merge_attrs(graph.nodes[entity['name']], attrs))
+        else:
+            graph.add_node(entity['name'], **attrs)
+
+    for relationship in eAndr.get('relationships', []):
+        
+        if relationship.get('source') != None and relationship.get('target') != None:
+            source, target = relationship['source'], relationship['target']
+            attrs = dict({'relationship': relationship.get('relationship'), 'count': 1,
+                          'strength': relationship.get('relationship_strength', relationship.get('strength'))}, **spans)
+            if graph.has_edge(source, target):
+                graph.edges[source, target].update(merge_attrs(graph.edges[source, target], attrs))
+            else:
+                graph.add_edge(source, target, **attrs)
+    mark_changed(graph)
+    return graph
+
 def create_knowledge_graph(parsed_entities_and_relationships):
     '''Create a knowledge graph from the parsed entities and relationships'''
     graph = nx.Graph()
 
     for eAndr in parsed_entities_and_relationships:
-
-        for entity in eAndr['entities']:
-            graph.add_node(entity['name'], type=entity.get('type'), description=entity.get('description'))
-
-        for relationship in eAndr['relationships']:
-            
-            if relationship.get('target') != None:
-            
-                graph.add_edge(relationship['source'], relationship.get('target'), relationship=relationship.get('relationship'), strength=relationship.get('relationship_strength'))
+        add_to_knowledge_graph(graph, eAndr)
                 
     return graph
 
-async def generate_summary(llm, graph):
-    '''Generate a summary from the knowledge graph'''
+async def generate_summary(llm, graph, use_cache=LLM_CACHE_ENABLED, on_token=None):
+    '''Generate a summary from the knowledge graph, streaming the tokens of the final call to on_token'''
     print(f'Graph: {str(graph)}')
-    # Relationships
-    relationships = [(edge[0], edge[1], graph.get_edge_data(edge[0], edge[1])) for edge in graph.edges]
-
-    # Generate summary
-    entitiesAndRelations = []
-    for edge in relationships:
-        entitiesAndRelations.append((f"Source: {edge[0]}", f"Description: {graph.nodes[edge[0]].get('description')}"))
-        entitiesAndRelations.append((f"Taregt: {edge[1]}", f"Description: {graph.nodes[edge[1]].get('description')}"))
-        entitiesAndRelations.append((f"Relationship: {edge[2]['relationship']} \n\n"))
-         
-    summary = await generate(llm, SUMMARIZE_PROMPT, {'entity_relationships_list': entitiesAndRelations})
+    with traced('summary', nodes=graph.number_of_nodes(), edges=graph.number_of_edges()):
+        # Summarize each community concurrently, then merge the community summaries
+        communities = cached_communities(graph)
+        if communities is None:
+            nodes = detect_communities(graph)
+            if len(nodes) > 1:
+                communities = await generate_community_summaries(llm, graph, communities=nodes, use_cache=use_cache)
+        if communities and len(communities) > 1:
+            return await reduce_summaries(llm, [community['summary'] for community in communities], use_cache=use_cache, on_token=on_token)
+
+        # A single community is summarized directly, without a community summary first
+        entity_list, relationship_list = pack_context(graph, SUMMARY_TOKEN_BUDGET)
+        summary = await generate_text(llm, SUMMARIZE_PROMPT, {'entity_relationships_list': f"{entity_list}\n\n{relationship_list}"}, on_token=on_token, use_cache=use_cache)
     return summary
 
-async def execute_rag_summarization(llm, video_text):
-    '''Execute the RAG summarization process for the video text'''
-    # Split the text into documents
-    doc_splits = split_text(video_text)
-    doc_splits = doc_splits[:20]    
-    # Generate domain
-    domain = await generate_domain(llm, doc_splits)
-    
-    # Generate entity types
-    entity_types = await generate_entity_types(llm, doc_splits, domain)
-    
-    # Generate entity types continuation
-    continuation_count = 7
-    for i in range(continuation_count):
-        entity_types += await generate_entity_types_continuation(llm, doc_splits, domain, entity_types)
-    
-    # Generate entities and relationships
-    entities_and_relationships = await generate_entities_and_relationships(llm, doc_splits, entity_types)
-    
-    # Parse entities and relationships
-    parsed_entities_and_relationships = parse_entities_and_relationships(entities_and_relationships)
-    
-    # Create knowledge graph
-    graph = create_knowledge_graph(parsed_entities_and_relationships)
+async def stream_knowledge_graph(llm, doc_splits, entity_types, graph=None, use_cache=LLM_CACHE_ENABLED, checkpoint=None, batch_size=EXTRACTION_BATCH_SIZE):
+    '''Build the knowledge graph chunk by chunk, yielding progress after each chunk is merged or fails'''
+    if graph is None:
+        graph = nx.Graph()
+    progress = {'chunks_done': 0, 'chunks_failed': 0, 'chunks_total': len(doc_splits)}
+
+    # Merge the chunks a previous run already extracted
+    completed = checkpoint.completed() if checkpoint else {}
+    for index, extracted_data in sorted(completed.items()):
+        add_to_knowledge_graph(graph, extracted_data, span=chunk_span(doc_splits[index]))
+        progress['chunks_done'] += 1
+    if completed:
+        print(f"Resumed {len(completed)} chunks from checkpoints")
+        yield dict(progress, event='chunk_done', chunk_index=None, nodes=graph.number_of_nodes(), edges=graph.number_of_edges(), graph=graph)
+
+    # The build span is made current only inside the extraction tasks, the context of a generator does not survive its yields
+    build = start_span('graph_build', chunks=len(doc_splits), resumed=len(completed))
+
+    async def extract(batch):
+        with use_span(build):
+            results = await extract_chunks(llm, [doc_splits[index] for index in batch], entity_types, use_cache=use_cache)
+        return list(zip(batch, results))
+
+    # Extract the remaining chunks in batches, checkpointing each chunk as its batch completes
+    pending = [index for index in range(len(doc_splits)) if index not in completed]
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    try:
+        async for results in as_completed_bounded(extract, batches, window=max(1, EXTRACTION_WINDOW // batch_size)):
+            for index, (extracted_data, error) in results:
+                if error is not None:
+                    if checkpoint:
+                        checkpoint.fail(index, f"{type(error).__name__}: {error}")
+                    progress['chunks_failed'] += 1
+                    print(f"WARNING: chunk {index} failed: {type(error).__name__}: {error}")
+                    yield dict(progress, event='chunk_failed', chunk_index=index, error=str(error))
+                    continue
+
+                if checkpoint:
+                    checkpoint.save(index, extracted_data)
+                add_to_knowledge_graph(graph, extracted_data, span=chunk_span(doc_splits[index]))
+                progress['chunks_done'] += 1
+                yield dict(progress, event='chunk_done', chunk_index=index, nodes=graph.number_of_nodes(), edges=graph.number_of_edges(), graph=graph)
+    finally:
+        build.set(chunks_done=progress['chunks_done'], chunks_failed=progress['chunks_failed'], nodes=graph.number_of_nodes(), edges=graph.number_of_edges())
+        build.end()
+
+async def stream_rag_summarization(llm, video_text, use_cache=LLM_CACHE_ENABLED, mode=PIPELINE_MODE, early_summary_at=EARLY_SUMMARY_FRACTION, resolve=ENTITY_RESOLUTION, segments=None,
+                                   checkpoints=CHECKPOINTS_ENABLED):
+    '''Run the RAG summarization process, yielding progress events as the graph is built'''
+    # Split the text into documents, on segment boundaries when timestamps are available
+    with traced('split') as span:
+        doc_splits = split_transcript(video_text, segments)
+        span.set(chunks=len(doc_splits))
+    if mode == 'full_context':
+        doc_splits = doc_splits[:MAX_CONTEXT_CHUNKS]
+        context_splits = doc_splits
+    elif mode == 'map_reduce':
+        context_splits = sample_chunks(doc_splits)
+    else:
+        raise ValueError(f"Unknown pipeline mode: {mode}")
+    print(f"Processing {len(doc_splits)} chunks, {len(context_splits)} used for domain and entity types")
+    yield {'event': 'split', 'chunks_total': len(doc_splits)}
+
+    # Resume the domain and entity types of an interrupted run so its chunk results stay valid
+    checkpoint = get_checkpoint_store().run(make_run_key(llm, doc_splits, mode, EXTRACTION_PROMPTS)) if checkpoints else None
+    if checkpoint and not use_cache:
+        # A cache bypass extracts everything again, replacing the checkpoints of earlier runs
+        checkpoint.clear()
+    context = checkpoint.load_context() if checkpoint else None
+    if context:
+        domain, entity_types = context['domain'], context['entity_types']
+        yield {'event': 'domain', 'domain': domain}
+        yield {'event': 'entity_types', 'entity_types': entity_types}
+    else:
+        # Generate domain
+        domain = await generate_domain(llm, context_splits, use_cache=use_cache)
+        yield {'event': 'domain', 'domain': domain}
+
+        # Generate entity types and their continuations
+        entity_types = await discover_entity_types(llm, context_splits, domain, use_cache=use_cache)
+        yield {'event': 'entity_types', 'entity_types': entity_types}
+    if checkpoint:
+        checkpoint.save_context(domain, entity_types)
     
-    # Generate summary
-    summary = await generate_summary(llm, graph)
+    # Generate, parse and merge entities and relationships into the graph as each chunk completes
+    graph = nx.Graph(domain=domain, entity_types=entity_types)
+    preview_task = None
+    preview_delivered = False
+    chunks_failed = 0
+    try:
+        async for event in stream_knowledge_graph(llm, doc_splits, entity_types, graph, use_cache=use_cache, checkpoint=checkpoint):
+            yield event
+            chunks_failed = event['chunks_failed']
+            if event['event'] != 'chunk_done':
+                continue
+
+            # Start a preview summary on a snapshot of the partial graph
+            if preview_task is None and early_summary_at is not None and event['chunks_done'] < event['chunks_total'] \
+                    and event['chunks_done'] >= early_summary_at * event['chunks_total']:
+                preview_task = asyncio.ensure_future(generate_summary(llm, graph.copy(), use_cache=use_cache))
+            if preview_task is not None and preview_task.done() and not preview_delivered:
+                preview_delivered = True
+                if preview_task.exception() is None:
+                    yield {'event': 'partial_summary', 'summary': preview_task.result(), 'chunks_done': event['chunks_done']}
+    finally:
+        if preview_task is not None and not preview_task.done():
+            preview_task.cancel()
     
-    return summary, graph
+    # Merge duplicate entities
+    if resolve:
+        embedder = get_embedder() if ENTITY_RESOLUTION_EMBEDDINGS else None
+        with traced('resolution'):
+            graph, report = resolve_entities(graph, embedder=embedder)
+        yield dict(report, event='resolution')
+
+    # Generate summary, yielding its tokens as they stream in
+    tokens = asyncio.Queue()
+    summary_task = asyncio.ensure_future(generate_summary(llm, graph, use_cache=use_cache, on_token=tokens.put_nowait))
+    summary_task.add_done_callback(lambda _: tokens.put_nowait(None))
+    try:
+        while (token := await tokens.get()) is not None:
+            yield {'event': 'summary_token', 'token': token}
+    finally:
+        summary_task.cancel()
+    summary = await summary_task
+    if chunks_failed:
+        print(f"WARNING: {chunks_failed} chunks failed and are missing from the graph, rerun to retry them")
+    yield {'event': 'done', 'summary': summary, 'graph': graph, 'chunks_failed': chunks_failed}
+
+async def execute_rag_summarization(llm, video_text, use_cache=LLM_CACHE_ENABLED, mode=PIPELINE_MODE, on_progress=None, segments=None):
+    '''Execute the RAG summarization process for the video text'''
+    early_summary_at = EARLY_SUMMARY_FRACTION if on_progress else None
+    with traced('summarization', mode=mode):
+        async for event in stream_rag_summarization(llm, video_text, use_cache=use_cache, mode=mode, early_summary_at=early_summary_at, segments=segments):
+            if on_progress:
+                on_progress(event)
+            if event['event'] == 'done':
+                return event['summary'], event['graph']
+
+def select_chunks(doc_splits, start, end):
+    '''Select the document splits that overlap the [start, end] time range'''
+    return [doc for doc in doc_splits if doc.metadata.get('start') is not None and doc.metadata['start'] < end and doc.metadata['end'] > start]
+
+def within_range(spans, start, end):
+    '''Check whether every span lies inside the [start, end] time range'''
+    return bool(spans) and all(span_start >= start and span_end <= end for span_start, span_end in spans)
 
-async def get_relevant_entities(llm, graph, query):
+async def reprocess_time_range(llm, graph, segments, start, end, use_cache=LLM_CACHE_ENABLED):
+    '''Re-extract only the chunks overlapping a time range and merge them back into the graph'''
+    doc_splits = select_chunks(split_segments(segments), start, end)
+    if not doc_splits:
+        return graph
+    # Compare against the rounded spans stored on the graph, see chunk_span
+    start, end = chunk_span(doc_splits[0])[0], chunk_span(doc_splits[-1])[1]
+
+    # Drop what came only from the affected chunks, then extract them again
+    graph.remove_edges_from([(u, v) for u, v, data in graph.edges(data=True) if within_range(data.get('spans'), start, end)])
+    graph.remove_nodes_from([node for node, data in graph.nodes(data=True) if within_range(data.get('spans'), start, end)])
+    mark_changed(graph)
+    async for event in stream_knowledge_graph(llm, doc_splits, graph.graph.get('entity_types', []), graph, use_cache=use_cache):
+        pass
+    graph.graph.pop('communities', None)
+    invalidate_graph(graph)
+    return graph
+
+async def get_relevant_entities(llm, graph, query, use_cache=LLM_CACHE_ENABLED, candidates=None):
     '''Get relevant entities based on the query'''
+    # Reuse the selection of the same or a near-duplicate question on this graph
+    query_cache = get_query_cache() if use_cache and QUERY_CACHE_ENABLED else None
+    if query_cache:
+        scope = query_scope('selection', llm, graph, candidates is not None)
+        cached = query_cache.get(scope, query)
+        if cached is not None:
+            return cached
+    started = time.perf_counter()
+
     # Generate relevant entities and relationships based on a query
-    entity_list = list(graph.nodes(data=True))
-    relevant_entities = await generate(llm, QUERY_ENTITIES_PROMPT, {'query': query, 'entity_list': entity_list})
-    relevant_entities = json.loads(relevant_entities)
+    if candidates is None:
+        entity_list, _ = pack_context(graph, QUERY_TOKEN_BUDGET, edges=[])
+    else:
+        candidates = [entity for entity in candidates if entity in graph.nodes]
+        node_scores = {entity: 1.0 - rank / len(candidates) for rank, entity in enumerate(candidates)}
+        entity_list, _ = pack_context(graph, QUERY_TOKEN_BUDGET, nodes=candidates, edges=[], node_scores=node_scores)
+    relevant_entities = await generate_json(llm, QUERY_ENTITIES_PROMPT, {'query': query, 'entity_list': entity_list}, RELEVANT_ENTITIES_SCHEMA, use_cache=use_cache)
     print(relevant_entities)
+    if query_cache:
+        query_cache.set(scope, query, relevant_entities, seconds=time.perf_counter() - started)
     return relevant_entities
 
-async def model_chat(llm, graph, query):
-    '''Chat with the model based on the query and the knowledge graph'''
-    # Get relevant entities
-    relevant_entities = await get_relevant_entities(llm, graph, query)
+def pack_query_context(graph, seeds, token_budget=QUERY_TOKEN_BUDGET):
+    '''Pack the selected entities and their multi-hop neighbourhoods into the query token budget'''
+    # Walk from the selected entities, earlier selections weighted higher, and keep the best ranked nodes within reach
+    seed_weights = [1.0 - rank / (2 * max(len(seeds), 1)) for rank in range(len(seeds))]
+    scores, edges = get_graph_index(graph).top_k_subgraph(seeds, seed_weights=seed_weights)
+
+    # Selected entities rank by selection order, others by PageRank normalized to [0, 1]
+    max_score = max((score for node, score in scores.items() if node not in seeds), default=0) or 1
+    node_scores = {node: score / max_score for node, score in scores.items()}
+    for rank, seed in enumerate(seeds):
+        if seed in node_scores:
+            node_scores[seed] = 2.0 - rank / max(len(seeds), 1)
+    return pack_context(graph, token_budget, nodes=list(node_scores), edges=edges, node_scores=node_scores)
+
+async def prepare_global_query(llm, graph, query, use_cache=LLM_CACHE_ENABLED, embedder=None):
+    '''Build the prompt answering a broad query from the community summaries, returning (prompt, prompt values)'''
+    communities = await generate_community_summaries(llm, graph, use_cache=use_cache)
+    summaries = [community['summary'] for community in communities]
+
+    # Keep the community summaries closest to the query
+    if len(summaries) > GLOBAL_QUERY_COMMUNITIES:
+        embedder = embedder or get_embedder()
+        scores = embedder.embed_documents(summaries) @ embedder.embed_query(query)
+        summaries = [summaries[i] for i in top_k(scores, GLOBAL_QUERY_COMMUNITIES)]
+
+    return GLOBAL_QUERY_PROMPT, {'query': query, 'community_summaries': '\n\n'.join(summaries)}
+
+async def global_chat(llm, graph, query, use_cache=LLM_CACHE_ENABLED, embedder=None):
+    '''Answer a broad query from the community summaries instead of individual entities'''
+    prompt, prompt_vals = await prepare_global_query(llm, graph, query, use_cache=use_cache, embedder=embedder)
+    response = await generate(llm, prompt, prompt_vals, use_cache=use_cache)
+    print(response)
+    return response
+
+async def prepare_query(llm, graph, query, use_cache=LLM_CACHE_ENABLED, entity_index=None, skip_entity_selection=SKIP_ENTITY_SELECTION, query_mode='local', chunk_index=None):
+    '''Retrieve the context of a query and build its answer prompt, returning (prompt, prompt values)'''
+    # Broad questions are answered from the community summaries
+    if query_mode == 'global':
+        embedder = entity_index.embedder if entity_index is not None else None
+        return await prepare_global_query(llm, graph, query, use_cache=use_cache, embedder=embedder)
+
+    # Get relevant entities, narrowing the candidates with the entity index if available
+    if entity_index is not None:
+        candidates = [name for name, score in entity_index.search(query, k=ENTITY_CANDIDATES)]
+        if skip_entity_selection:
+            relevant_entities = {'relevant_entities': candidates}
+        else:
+            relevant_entities = await get_relevant_entities(llm, graph, query, use_cache=use_cache, candidates=candidates)
+    else:
+        relevant_entities = await get_relevant_entities(llm, graph, query, use_cache=use_cache)
     
-    # Generate response to the query
-    relevant_entities_list = [entity for entity in relevant_entities['relevant_entities']]
+    seeds = [entity for entity in relevant_entities['relevant_entities'] if entity in graph.nodes]
+    relevant_entities_list, relevant_relationships_list = pack_query_context(graph, seeds)
 
-    relevant_relationships_list = []
-    for entity in relevant_entities_list:
-        if entity not in graph.nodes:
-            continue
-        neighbors = list(graph.neighbors(entity))
-        for neighbor in neighbors:
-            relevant_relationships_list.append((entity, neighbor, graph.get_edge_data(entity, neighbor)))
+    # Transcript excerpts cover quotes and numbers that never became entities
+    chunk_list = ''
+    if chunk_index is not None:
+        chunk_list = pack_chunks(chunk_index.chunks, [index for index, score in chunk_index.search(query)])
+
+    return QUERY_PROMPT, {'query': query, 'entity_list': relevant_entities_list, 'relationship_list': relevant_relationships_list, 'chunk_list': chunk_list}
 
-    relevant_entities_list = [(entity, graph.nodes[entity].get('description')) for entity in relevant_entities_list if entity in graph.nodes]
+def answer_scope(llm, graph, entity_index=None, skip_entity_selection=SKIP_ENTITY_SELECTION, query_mode='local', chunk_index=None):
+    '''Scope cached answers by everything besides the question that changes them'''
+    return query_scope('answer', llm, graph, query_mode, entity_index is not None, entity_index is not None and bool(skip_entity_selection), chunk_index is not None)
+
+async def model_chat(llm, graph, query, use_cache=LLM_CACHE_ENABLED, entity_index=None, skip_entity_selection=SKIP_ENTITY_SELECTION, query_mode='local', chunk_index=None):
+    '''Chat with the model based on the query and the knowledge graph'''
+    with traced('chat', mode=query_mode) as span:
+        # Answer the same or a near-duplicate question on this graph from the query cache
+        query_cache = get_query_cache() if use_cache and QUERY_CACHE_ENABLED else None
+        if query_cache:
+            scope = answer_scope(llm, graph, entity_index, skip_entity_selection, query_mode, chunk_index)
+            cached = query_cache.get(scope, query)
+            if cached is not None:
+                span.incr('query_cache_hits')
+                return cached
+        started = time.perf_counter()
 
-    response = await generate(llm, QUERY_PROMPT, {'query': query, 'entity_list': relevant_entities_list, 'relationship_list': relevant_relationships_list})
+        prompt, prompt_vals = await prepare_query(llm, graph, query, use_cache=use_cache, entity_index=entity_index,
+                                                  skip_entity_selection=skip_entity_selection, query_mode=query_mode, chunk_index=chunk_index)
+
+        # Generate response to the query
+        response = await generate(llm, prompt, prompt_vals, use_cache=use_cache)
     print(response)
-    return response
\ No newline at end of file
+    if query_cache:
+        query_cache.set(scope, query, response, seconds=time.perf_counter() - started)
+    return response
+
+async def model_chat_stream(llm, graph, query, use_cache=LLM_CACHE_ENABLED, entity_index=None, skip_entity_selection=SKIP_ENTITY_SELECTION, query_mode='local', chunk_index=None):
+    '''Chat with the model like model_chat, yielding the response tokens as they arrive'''
+    # The chat span is made current only between yields, the context of a generator does not survive them
+    chat = start_span('chat', mode=query_mode, streamed=True)
+    query_cache = get_query_cache() if use_cache and QUERY_CACHE_ENABLED else None
+    if query_cache:
+        scope = answer_scope(llm, graph, entity_index, skip_entity_selection, query_mode, chunk_index)
+        cached = query_cache.get(scope, query)
+        if cached is not None:
+            chat.incr('query_cache_hits')
+            chat.end()
+            yield cached
+            return
+    started = time.perf_counter()
+
+    parts = []
+    error = None
+    try:
+        with use_span(chat):
+            prompt, prompt_vals = await prepare_query(llm, graph, query, use_cache=use_cache, entity_index=entity_index,
+                                                      skip_entity_selection=skip_entity_selection, query_mode=query_mode, chunk_index=chunk_index)
+        async for token in generate_stream(llm, prompt, prompt_vals, use_cache=use_cache, parent=chat):
+            parts.append(token)
+            yield token
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        chat.end(error=error)
+
+    # Only answers streamed to the end are cached
+    if query_cache:
+        query_cache.set(scope, query, ''.join(parts), seconds=time.perf_counter() - started)
\ No newline at end of file
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from config import LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES
+
+def get_model_name(llm):
+    '''Get a stable name for the model behind a langchain llm'''
+    name = getattr(llm, 'model_name', None) or getattr(llm, 'model', None)
+    return f"{type(llm).__name__}:{name}"
+
+def make_cache_key(llm, prompt, prompt_vals, struct=None, isStructuredResponse=False):
+    '''Build a content-addressed key from the model, prompt template and prompt values'''
+    template_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    rendered_vals = json.dumps(prompt_vals, sort_keys=True, default=str)
+    key_data = json.dumps({
+        'model': get_model_name(llm),
+        'temperature': getattr(llm, 'temperature', None),
+        'template': template_hash,
+        'values': rendered_vals,
+        'struct': json.dumps(struct, sort_keys=True, default=str) if isStructuredResponse else None,
+    }, sort_keys=True)
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+class LLMCache:
+    '''Persistent SQLite cache for LLM responses with TTL and LRU eviction'''
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT,
+            created_at REAL,
+            accessed_at REAL)''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)')
+        self._conn.commit()
+
+    def get(self, key):
+        '''Return the cached response for a key, or None on a miss'''
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT response, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            response, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(response)
+
+    def set(self, key, response, model=None):
+        '''Store a response and evict the least recently used entries over the size limit'''
+        try:
+            data = json.dumps(response)
+        except TypeError:
+            # Only JSON-serializable responses are cached
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', (key, model, data, now, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        '''Drop expired entries and the least recently used ones over max_entries'''
+        if self.ttl is not None:
+            self._conn.execute('DELETE FROM responses WHERE created_at < ?', (time.time() - self.ttl,))
+        if self.max_entries is not None:
+            count = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute('''DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)''', (count - self.max_entries,))
+
+    def clear(self):
+        '''Remove every cached response'''
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+
+    def stats(self):
+        '''Return hit/miss counters and the number of stored entries'''
+        with self._lock:
+            size = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': size,
+        }
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    '''Get the process-wide LLM response cache'''
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache()
+    return _default_cache
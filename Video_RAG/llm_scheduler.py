@@ -0,0 +1,249 @@
+import time
+import random
+import asyncio
+import threading
+from tracing import incr
+from config import PROVIDER_LIMITS, LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_EXPECTED_OUTPUT_TOKENS
+
+TRANSIENT_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+TRANSIENT_ERROR_NAMES = ('RateLimit', 'Timeout', 'APIConnection', 'Overloaded', 'InternalServer', 'ServiceUnavailable')
+
+def get_provider(llm):
+    '''Get the provider name for a langchain llm'''
+    name = type(llm).__name__.lower()
+    for provider in PROVIDER_LIMITS:
+        if provider in name:
+            return provider
+    return 'default'
+
+def estimate_prompt_tokens(prompt, prompt_vals=None):
+    '''Roughly estimate the prompt tokens of a call'''
+    return (len(prompt) + sum(len(str(val)) for val in (prompt_vals or {}).values())) // 4
+
+def estimate_output_tokens(llm=None):
+    '''Expected completion tokens of a call, reserved until its actual usage is known'''
+    max_output = getattr(llm, 'max_tokens', None) or getattr(llm, 'max_tokens_to_sample', None) or LLM_EXPECTED_OUTPUT_TOKENS
+    return min(max_output, LLM_EXPECTED_OUTPUT_TOKENS)
+
+def estimate_tokens(prompt, prompt_vals, llm=None):
+    '''Roughly estimate prompt plus expected completion tokens for rate limiting'''
+    return estimate_prompt_tokens(prompt, prompt_vals) + estimate_output_tokens(llm)
+
+def is_transient_error(error):
+    '''Check whether an error from a provider is worth retrying'''
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    if status is None and getattr(error, 'response', None) is not None:
+        status = getattr(error.response, 'status_code', None)
+    if status in TRANSIENT_STATUS_CODES:
+        return True
+    return any(name in type(error).__name__ for name in TRANSIENT_ERROR_NAMES)
+
+def get_retry_after(error):
+    '''Get the Retry-After delay in seconds advertised by the provider, if any'''
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    '''Thread-safe token bucket refilled continuously at a per-minute rate'''
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        '''Reserve tokens and return how long to wait before using them'''
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    async def acquire(self, amount=1):
+        '''Wait until the requested amount of tokens is available'''
+        wait = self.reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def adjust(self, amount):
+        '''Charge extra tokens, or refund reserved ones with a negative amount'''
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate - amount)
+            self.updated_at = now
+
+class ConcurrencyLimiter:
+    '''Process-wide async semaphore that works across event loops and threads'''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        # FIFO of [loop, future, granted] for the calls waiting for a slot
+        self._waiters = []
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        '''Wait for a free slot'''
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = [loop, loop.create_future(), False]
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter[2]
+                if not granted:
+                    self._waiters.remove(waiter)
+            # A slot handed over while the waiter was being cancelled passes on to the next one
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        '''Free a slot, handing it to the longest waiting call on any loop'''
+        with self._lock:
+            if not self._waiters:
+                self.active -= 1
+                return
+            waiter = self._waiters.pop(0)
+            waiter[2] = True
+        loop, future = waiter[0], waiter[1]
+        try:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        except RuntimeError:
+            # The waiting loop is closed, so nobody takes the slot
+            self.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+class LLMScheduler:
+    '''Shared scheduler that bounds concurrency, rate limits and retries LLM calls per provider'''
+
+    def __init__(self, limits=PROVIDER_LIMITS, max_retries=LLM_MAX_RETRIES,
+                 base_delay=LLM_RETRY_BASE_DELAY, max_delay=LLM_RETRY_MAX_DELAY):
+        self.limits = limits
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self._request_buckets = {}
+        self._token_buckets = {}
+        # One limiter per provider shared by every event loop, e.g. the threads of batch ingestion
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+        for provider, limit in limits.items():
+            if limit.get('requests_per_minute'):
+                self._request_buckets[provider] = TokenBucket(limit['requests_per_minute'])
+            if limit.get('tokens_per_minute'):
+                self._token_buckets[provider] = TokenBucket(limit['tokens_per_minute'])
+
+    def _get_limiter(self, provider):
+        '''Get the process-wide concurrency limiter of a provider'''
+        with self._lock:
+            if provider not in self._limiters:
+                concurrency = self.limits.get(provider, self.limits['default'])['concurrency']
+                self._limiters[provider] = ConcurrencyLimiter(concurrency)
+            return self._limiters[provider]
+
+    def reconcile(self, provider, reserved, used):
+        '''Correct the token budget of a provider once the actual usage of a call is known'''
+        if provider in self._token_buckets and used is not None:
+            self._token_buckets[provider].adjust(used - reserved)
+
+    def _backoff(self, attempt, error):
+        '''Jittered exponential backoff delay for a retry attempt'''
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(0, delay)
+
+    async def run(self, provider, call, tokens=0):
+        '''Run an async LLM call under the provider limits, retrying transient errors'''
+        limiter = self._get_limiter(provider)
+        attempt = 0
+        while True:
+            async with limiter:
+                if provider in self._request_buckets:
+                    await self._request_buckets[provider].acquire(1)
+                if provider in self._token_buckets and tokens:
+                    await self._token_buckets[provider].acquire(tokens)
+                try:
+                    return await call()
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_transient_error(e):
+                        raise
+                    error = e
+
+            # Sleep outside the limiter so other calls can proceed
+            delay = self._backoff(attempt, error)
+            attempt += 1
+            self.retries += 1
+            incr('retries')
+            print(f"WARNING: {provider} call failed with {type(error).__name__}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def stream(self, provider, call, tokens=0):
+        '''Stream an async LLM call under the provider limits, retrying transient errors until the first chunk arrives'''
+        limiter = self._get_limiter(provider)
+        attempt = 0
+        while True:
+            async with limiter:
+                if provider in self._request_buckets:
+                    await self._request_buckets[provider].acquire(1)
+                if provider in self._token_buckets and tokens:
+                    await self._token_buckets[provider].acquire(tokens)
+                started = False
+                chunks = call()
+                try:
+                    async for chunk in chunks:
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    # Chunks already handed out cannot be taken back, so only a stream that never started is retried
+                    if started or attempt >= self.max_retries or not is_transient_error(e):
+                        raise
+                    error = e
+                finally:
+                    # Closing the stream stops the request, including when the caller abandons it
+                    await chunks.aclose()
+
+            delay = self._backoff(attempt, error)
+            attempt += 1
+            self.retries += 1
+            incr('retries')
+            print(f"WARNING: {provider} stream failed with {type(error).__name__}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+def get_llm_scheduler():
+    '''Get the process-wide LLM scheduler'''
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = LLMScheduler()
+    return _default_scheduler
@@ -0,0 +1,23 @@
+from langchain_community.chat_models import ChatOllama
+from langchain_anthropic.chat_models import ChatAnthropic
+from langchain_openai.chat_models import ChatOpenAI
+
+
+MODELS = { #model name: requires API key
+    'llama3.1': False,
+    'llama3.2': False,
+    'mistral': False,
+    'gemma2': False,
+    'qwen2.5': False,
+    'claude-3-haiku-20240307': True,
+    'claude-3-5-haiku-20241022': True,
+    'gpt-4o-mini-2024-07-18': True
+}
+
+def create_llm(model, api_key=None):
+    '''Create the langchain chat model for a model name'''
+    if 'claude' in model:
+        return ChatAnthropic(model=model, anthropic_api_key=api_key, max_tokens_to_sample=4096, temperature=0.2)
+    elif 'gpt' in model:
+        return ChatOpenAI(model=model, openai_api_key=api_key)
+    return ChatOllama(model=model)
@@ -236,11 +236,131 @@ Your objective in this task is as follows:
 3. Examine the speaker information associated with the entities and relationships.
 4. Provide a detailed, and informative response to the query, incorporating relevant speaker insights from the video content.
 5. Refer to the speaker when responding to the query.
+6. Entities and relationships may carry the time ranges of the video they were mentioned in (e.g. @12:30-13:10). Cite the relevant time ranges in your response when available.
+7. You will also be provided with transcript excerpts that match the query. Use them for exact quotes, numbers and details that the entities and relationships do not cover.
 
 Input Data:
 Query: "{query}"
 Entities and their descriptions: {entity_list}
 Relationships: {relationship_list}
+Transcript excerpts: {chunk_list}
 
 YOU MUST ONLY RETURN THE RESPONSE TO THE QUERY AS A STRING WITH NO ADDITIONAL INFORMATION.
-"""
\ No newline at end of file
+"""
+COMMUNITY_SUMMARY_PROMPT = """
+Input Data:
+A community of closely related entities from a knowledge graph extracted from a video transcript.
+Entities and their descriptions:
+{entity_list}
+
+Relationships:
+{relationship_list}
+
+Your objective:
+1. Analyze the entities and relationships of this community.
+2. Write a concise summary of the topic this community covers, naming the key entities, speakers and how they relate.
+3. Highlight any facts, statistics, or insights that stand out.
+
+Remember:
+- Base your summary solely on the provided entities and relationships
+- Do not add external information or speculation
+- Keep the summary to one or two short paragraphs
+
+YOU MUST ONLY RETURN THE SUMMARY AS A STRING WITH NO ADDITIONAL INFORMATION.
+"""
+
+REDUCE_SUMMARIES_PROMPT = """
+Input Data:
+Summaries of the topic communities found in a knowledge graph extracted from a video transcript:
+{community_summaries}
+
+Your objective:
+1. Merge the community summaries into a single detailed informative summary that captures the essence of the video content.
+2. Present the information in a logical and easily understandable manner.
+3. Remove repetition between the community summaries.
+
+Guidelines:
+- Identify main speakers or key figures based on the video content.
+- Determine the primary topics or themes and expand on them.
+- Highlight any interesting facts, statistics, or unique insights.
+- Provide the response in a structured format as you see fit.
+
+Remember:
+- Use accessible language, explaining technical terms if needed
+- Maintain an informative and engaging tone
+- Base your summary solely on the provided summaries
+- Do not add external information or speculation
+- Ensure your summary feels like a natural, informative overview of the video content
+"""
+
+GLOBAL_QUERY_PROMPT = """
+As an AI assistant, your task is to answer a broad user query about a video using summaries of the topics covered in it.
+Your objective in this task is as follows:
+
+1. Analyze the given query.
+2. You will be provided with summaries of the topic communities of a knowledge graph derived from the video transcript.
+3. Combine the relevant information across the summaries into a detailed, and informative response.
+4. Refer to the speaker when responding to the query.
+
+Input Data:
+Query: "{query}"
+Topic summaries: {community_summaries}
+
+YOU MUST ONLY RETURN THE RESPONSE TO THE QUERY AS A STRING WITH NO ADDITIONAL INFORMATION.
+"""
+
+
+# JSON schemas for providers with structured output
+ENTITY_TYPES_SCHEMA = {
+    "title": "entity_types",
+    "description": "Entity types found in the text",
+    "type": "object",
+    "properties": {
+        "entity_types": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["entity_types"]
+}
+
+ENTITY_RELATIONSHIPS_SCHEMA = {
+    "title": "knowledge_graph",
+    "description": "Entities and relationships extracted from a video transcript",
+    "type": "object",
+    "properties": {
+        "entities": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "type": {"type": "string"},
+                    "description": {"type": "string"}
+                },
+                "required": ["name", "type", "description"]
+            }
+        },
+        "relationships": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "source": {"type": "string"},
+                    "target": {"type": "string"},
+                    "relationship": {"type": "string"},
+                    "strength": {"type": "integer"}
+                },
+                "required": ["source", "target", "relationship", "strength"]
+            }
+        }
+    },
+    "required": ["entities", "relationships"]
+}
+
+RELEVANT_ENTITIES_SCHEMA = {
+    "title": "relevant_entities",
+    "description": "Entities relevant to the query",
+    "type": "object",
+    "properties": {
+        "relevant_entities": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["relevant_entities"]
+}
@@ -0,0 +1,157 @@
+import re
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict
+import numpy as np
+from entity_index import get_embedder
+from llm_cache import get_model_name
+from graph_index import graph_revision
+from config import QUERY_CACHE_SIMILARITY, QUERY_CACHE_MAX_ENTRIES
+
+_versions = weakref.WeakKeyDictionary()
+_versions_lock = threading.Lock()
+
+def graph_version(graph):
+    '''Fingerprint the entities and relationships of a graph, so equal graphs share cache entries across sessions'''
+    revision = graph_revision(graph)
+    with _versions_lock:
+        cached = _versions.get(graph)
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+
+    digest = hashlib.sha256()
+    for node, data in sorted(graph.nodes(data=True), key=lambda node: str(node[0])):
+        digest.update(f"{node}\x00{data.get('description')}\x01".encode('utf-8'))
+    for u, v, data in sorted((tuple(sorted((str(u), str(v)))) + (data,) for u, v, data in graph.edges(data=True)), key=lambda edge: edge[:2]):
+        digest.update(f"{u}\x00{v}\x00{data.get('relationship')}\x01".encode('utf-8'))
+    version = digest.hexdigest()[:16]
+    with _versions_lock:
+        _versions[graph] = (revision, version)
+    return version
+
+def invalidate_graph(graph):
+    '''Drop the cached queries of a graph modified in place and forget its fingerprint'''
+    with _versions_lock:
+        cached = _versions.pop(graph, None)
+    if cached is not None:
+        get_query_cache().invalidate(cached[1])
+
+def query_scope(kind, llm, graph, *options):
+    '''Scope cache entries by kind, graph version, model and any options that change the result'''
+    return (kind, graph_version(graph), get_model_name(llm)) + options
+
+def normalize_query(query):
+    '''Lowercase a question and collapse whitespace and trailing punctuation'''
+    return re.sub(r'\s+', ' ', str(query).lower()).strip().rstrip('?!. ')
+
+def key_terms(query):
+    '''Get the numbers and name-like words of a question in order, which a near-duplicate must share'''
+    words = re.findall(r'[\w.+-]*\w', str(query))
+    terms = []
+    for i, word in enumerate(words):
+        # Capitalized words count as names except for a plain capitalized first word
+        name_like = any(c.isupper() for c in word[1:]) or (word[0].isupper() and (i > 0 or len(word) == 1))
+        if name_like or any(c.isdigit() for c in word):
+            terms.append(word.lower())
+    return tuple(terms)
+
+class SemanticQueryCache:
+    '''In-memory LRU cache of query results, served for exact or near-duplicate questions within a scope'''
+    # Near-duplicates are only served with a semantic embedder and when their numbers and names match
+
+    def __init__(self, embedder=None, threshold=QUERY_CACHE_SIMILARITY, max_entries=QUERY_CACHE_MAX_ENTRIES):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = {}
+        self.misses = {}
+        self.semantic_hits = 0
+        self.seconds_saved = 0.0
+        # (scope, normalized query) -> (vector, key terms, value, seconds), in least recently used order
+        self._entries = OrderedDict()
+        self._scopes = {}
+        self._lock = threading.Lock()
+
+    def _embed(self, normalized):
+        if self.embedder is None:
+            self.embedder = get_embedder()
+        if not getattr(self.embedder, 'semantic', True):
+            return None
+        return self.embedder.embed_query(normalized)
+
+    def get(self, scope, query):
+        '''Return the cached result of the query or of a near-duplicate in the scope, or None on a miss'''
+        kind = scope[0]
+        normalized = normalize_query(query)
+        vector = self._embed(normalized)
+        terms = key_terms(query)
+        with self._lock:
+            key = (scope, normalized)
+            if key not in self._entries:
+                keys = [k for k in self._scopes.get(scope, ()) if self._entries[k][1] == terms] if vector is not None else []
+                key = None
+                if keys:
+                    # Nearest cached question of the scope by cosine similarity
+                    vectors = np.stack([self._entries[k][0] for k in keys])
+                    scores = vectors @ vector
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.threshold:
+                        key = keys[best]
+                        self.semantic_hits += 1
+            if key is None:
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+
+            self._entries.move_to_end(key)
+            _, _, value, seconds = self._entries[key]
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            self.seconds_saved += seconds
+            return value
+
+    def set(self, scope, query, value, seconds=0.0):
+        '''Cache the result of a query, with the seconds it took to compute, evicting the least recently used entries'''
+        normalized = normalize_query(query)
+        key = (scope, normalized)
+        vector = self._embed(normalized)
+        with self._lock:
+            self._entries[key] = (vector, key_terms(query), value, seconds)
+            self._entries.move_to_end(key)
+            self._scopes.setdefault(scope, {})[key] = None
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                scope_keys = self._scopes[old_key[0]]
+                del scope_keys[old_key]
+                if not scope_keys:
+                    del self._scopes[old_key[0]]
+
+    def invalidate(self, version):
+        '''Drop the entries of a graph version'''
+        with self._lock:
+            for scope in [scope for scope in self._scopes if scope[1] == version]:
+                for key in self._scopes.pop(scope):
+                    del self._entries[key]
+
+    def stats(self):
+        '''Return hit/miss counters per kind, the hit rate and the LLM seconds saved by hits'''
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+                'semantic_hits': self.semantic_hits,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+                'seconds_saved': round(self.seconds_saved, 3),
+                'entries': len(self._entries),
+            }
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_query_cache():
+    '''Get the process-wide query cache, shared by every session'''
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SemanticQueryCache()
+    return _default_cache
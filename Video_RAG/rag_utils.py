@@ -1,13 +1,19 @@
 import json
 import re
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
+from config import LLM_CACHE_ENABLED, CHUNK_TOKENS, STRUCTURED_OUTPUT, STRUCTURED_OUTPUT_METHODS
+from context_packer import count_tokens
+from llm_cache import get_llm_cache, make_cache_key, get_model_name
+from llm_scheduler import get_provider, get_llm_scheduler, estimate_prompt_tokens, estimate_output_tokens
+from chain_registry import get_chain_registry
+from tolerant_json import parse_json
+from tracing import traced, start_span, incr
 
 def split_text(video_text):
     '''split text into chunks'''
     text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=400, chunk_overlap=0)
+        chunk_size=CHUNK_TOKENS, chunk_overlap=0)
 
     #get docs
     docs = text_splitter.create_documents([video_text])
@@ -17,23 +23,181 @@ def split_text(video_text):
     
     return doc_splits
 
-async def generate(llm, prompt, prompt_vals, struct=None, isStructuredResponse=False):
+def segment_tokens(segment):
+    '''token count of a transcript segment, using the ASR tokens when available'''
+    if segment.get('tokens'):
+        return len(segment['tokens'])
+    return count_tokens(segment['text'])
+
+def segments_to_document(segments):
+    '''join consecutive transcript segments into a document with start/end times'''
+    text = ''.join(segment['text'] for segment in segments).strip()
+    return Document(page_content=text, metadata={'start': segments[0]['start'], 'end': segments[-1]['end']})
+
+def split_segments(segments, chunk_size=CHUNK_TOKENS):
+    '''split timestamped transcript segments into chunks on segment boundaries'''
+    doc_splits = []
+    current, current_tokens = [], 0
+    for segment in segments:
+        tokens = segment_tokens(segment)
+        if current and current_tokens + tokens > chunk_size:
+            doc_splits.append(segments_to_document(current))
+            current, current_tokens = [], 0
+        current.append(segment)
+        current_tokens += tokens
+    if current:
+        doc_splits.append(segments_to_document(current))
+    return doc_splits
+
+def split_transcript(video_text, segments=None):
+    '''split a transcript into chunks, on segment boundaries when timestamps are available'''
+    if segments:
+        return split_segments(segments)
+    return split_text(video_text)
+
+def chunk_records(doc_splits):
+    '''convert document splits to JSON-serializable chunk records'''
+    return [dict(doc.metadata, text=doc.page_content) for doc in doc_splits]
+
+async def generate(llm, prompt, prompt_vals, struct=None, isStructuredResponse=False, use_cache=LLM_CACHE_ENABLED):
     '''generate a response from a prompt using langchain'''
-    input_vars = [key for key in prompt_vals.keys()]
-    prompt = PromptTemplate(template=prompt, input_variables=input_vars)
-
-    # Chain
-    if isStructuredResponse:
-        structured_llm = llm.with_structured_output(struct, method='json_schema')
-        chain = prompt | structured_llm 
-    else:
-        chain = prompt | llm | StrOutputParser()
-    
-    # Run
+    # Check the response cache
+    if use_cache:
+        cache = get_llm_cache()
+        cache_key = make_cache_key(llm, prompt, prompt_vals, struct, isStructuredResponse)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            incr('cache_hits')
+            return cached
+        incr('cache_misses')
+
+    # Reuse the compiled chain for this prompt, model and output mode
+    method = get_structured_output_method(llm) or 'json_schema'
+    chain = get_chain_registry().chain(llm, prompt, prompt_vals.keys(), struct, isStructuredResponse, method=method)
+
+    # The chain calls the model through the shared scheduler
     generation = await chain.ainvoke(prompt_vals)
+
+    if use_cache:
+        cache.set(cache_key, generation, model=get_model_name(llm))
     
     return generation
 
+async def generate_stream(llm, prompt, prompt_vals, use_cache=LLM_CACHE_ENABLED, parent=None):
+    '''stream a text response token by token, caching it only once it is complete'''
+    if use_cache:
+        cache = get_llm_cache()
+        cache_key = make_cache_key(llm, prompt, prompt_vals, None, False)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            incr('cache_hits', span=parent)
+            yield cached
+            return
+        incr('cache_misses', span=parent)
+
+    registry = get_chain_registry()
+    prompt_value = registry.template(prompt, prompt_vals.keys()).format_prompt(**prompt_vals)
+    chain = registry.stream_chain(llm)
+    prompt_tokens = estimate_prompt_tokens(prompt_value.to_string())
+    tokens = prompt_tokens + estimate_output_tokens(llm)
+
+    # Closing this generator early closes the model stream, so abandoned requests stop generating
+    parts = []
+    # The span is not made current, the context of a generator does not survive its yields
+    span = start_span('llm_call', parent=parent, provider=get_provider(llm), model=get_model_name(llm), streamed=True)
+    span.incr('llm_calls')
+    span.incr('prompt_tokens', prompt_tokens)
+    scheduler = get_llm_scheduler()
+    stream = scheduler.stream(get_provider(llm), lambda: chain.astream(prompt_value), tokens=tokens)
+    error = None
+    try:
+        async for token in stream:
+            parts.append(token)
+            yield token
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        await stream.aclose()
+        completion_tokens = count_tokens(''.join(parts))
+        scheduler.reconcile(get_provider(llm), tokens, prompt_tokens + completion_tokens)
+        span.incr('completion_tokens', completion_tokens)
+        span.end(error=error)
+
+    if use_cache:
+        cache.set(cache_key, ''.join(parts), model=get_model_name(llm))
+
+async def generate_text(llm, prompt, prompt_vals, on_token=None, use_cache=LLM_CACHE_ENABLED):
+    '''generate a text response, streaming tokens to on_token when given'''
+    if on_token is None:
+        return await generate(llm, prompt, prompt_vals, use_cache=use_cache)
+    parts = []
+    async for token in generate_stream(llm, prompt, prompt_vals, use_cache=use_cache):
+        parts.append(token)
+        on_token(token)
+    return ''.join(parts)
+
+async def generate_batch(llm, prompt, prompt_vals_list, struct=None, isStructuredResponse=False, use_cache=LLM_CACHE_ENABLED, spans=None):
+    '''generate responses for many prompt values with one chain.abatch call, returning a response or exception per item; spans are optional per-item parent spans'''
+    generations = [None] * len(prompt_vals_list)
+    misses = list(range(len(prompt_vals_list)))
+    spans = spans or [None] * len(prompt_vals_list)
+
+    # Check the response cache
+    if use_cache:
+        cache = get_llm_cache()
+        cache_keys = [make_cache_key(llm, prompt, prompt_vals, struct, isStructuredResponse) for prompt_vals in prompt_vals_list]
+        misses = []
+        for i, cache_key in enumerate(cache_keys):
+            generations[i] = cache.get(cache_key)
+            if generations[i] is None:
+                misses.append(i)
+            incr('cache_hits' if generations[i] is not None else 'cache_misses', span=spans[i])
+    if not misses:
+        return generations
+
+    # Submit the misses together, each item still goes through the shared scheduler
+    method = get_structured_output_method(llm) or 'json_schema'
+    chain = get_chain_registry().chain(llm, prompt, prompt_vals_list[0].keys(), struct, isStructuredResponse, method=method)
+    configs = [{'metadata': {'parent_span': spans[i]}} if spans[i] is not None else {} for i in misses]
+    batch = await chain.abatch([prompt_vals_list[i] for i in misses], config=configs, return_exceptions=True)
+
+    for i, generation in zip(misses, batch):
+        generations[i] = generation
+        if use_cache and not isinstance(generation, BaseException):
+            cache.set(cache_keys[i], generation, model=get_model_name(llm))
+    return generations
+
+def get_structured_output_method(llm):
+    '''get the with_structured_output method supported by the provider of an llm, or None'''
+    if not STRUCTURED_OUTPUT:
+        return None
+    return STRUCTURED_OUTPUT_METHODS.get(get_provider(llm))
+
+async def generate_json(llm, prompt, prompt_vals, schema, use_cache=LLM_CACHE_ENABLED):
+    '''generate a JSON object, schema-validated where the provider supports structured output'''
+    if get_structured_output_method(llm):
+        response = await generate(llm, prompt, prompt_vals, struct=schema, isStructuredResponse=True, use_cache=use_cache)
+        if isinstance(response, dict):
+            return response
+    # Parse free text output in a single tolerant pass
+    response = await generate(llm, prompt, prompt_vals, use_cache=use_cache)
+    with traced('parse'):
+        return parse_json(response)
+
+async def generate_json_batch(llm, prompt, prompt_vals_list, schema, use_cache=LLM_CACHE_ENABLED, spans=None):
+    '''generate a JSON object per prompt values with one batched call, returning a dict or exception per item'''
+    structured = get_structured_output_method(llm) is not None
+    responses = await generate_batch(llm, prompt, prompt_vals_list, struct=schema if structured else None, isStructuredResponse=structured, use_cache=use_cache, spans=spans)
+    results = []
+    with traced('parse', items=len(responses)):
+        for response in responses:
+            try:
+                results.append(response if isinstance(response, (dict, BaseException)) else parse_json(response))
+            except ValueError as e:
+                results.append(e)
+    return results
+
 
 def extract_json_data(text):
     '''Parse JSON data with entities and relationships structure'''
@@ -0,0 +1,137 @@
+import io
+import os
+import json
+import time
+import math
+import numpy as np
+import networkx as nx
+from config import VIDEO_STORE_DIR, TRANSCRIPT_VERSION, PIPELINE_VERSION
+
+def _json_array(data):
+    '''Encode JSON-serializable data as a uint8 array'''
+    return np.frombuffer(json.dumps(data, default=str).encode('utf-8'), dtype=np.uint8)
+
+def _from_json_array(array):
+    '''Decode a uint8 array written by _json_array'''
+    return json.loads(array.tobytes().decode('utf-8'))
+
+def _to_float(value):
+    '''Convert a relationship strength to float, NaN if missing or invalid'''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def graph_to_npz(graph):
+    '''Serialize a knowledge graph to compressed node/edge arrays'''
+    names = list(graph.nodes)
+    index = {name: i for i, name in enumerate(names)}
+    edges = list(graph.edges(data=True))
+
+    edge_index = np.array([(index[u], index[v]) for u, v, _ in edges], dtype=np.int32).reshape(-1, 2)
+    edge_strength = np.array([_to_float(data.get('strength')) for _, _, data in edges], dtype=np.float32)
+    edge_attrs = [{k: v for k, v in data.items() if k != 'strength'} for _, _, data in edges]
+    graph_attrs = {k: v for k, v in graph.graph.items() if not str(k).startswith('_')}
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer,
+                        node_names=_json_array(names),
+                        node_attrs=_json_array([graph.nodes[name] for name in names]),
+                        edge_index=edge_index,
+                        edge_strength=edge_strength,
+                        edge_attrs=_json_array(edge_attrs),
+                        graph_attrs=_json_array(graph_attrs))
+    return buffer.getvalue()
+
+def graph_from_npz(data):
+    '''Deserialize a knowledge graph written by graph_to_npz'''
+    arrays = np.load(io.BytesIO(data))
+    names = _from_json_array(arrays['node_names'])
+    node_attrs = _from_json_array(arrays['node_attrs'])
+    edge_attrs = _from_json_array(arrays['edge_attrs'])
+
+    graph = nx.Graph(**_from_json_array(arrays['graph_attrs']))
+    graph.add_nodes_from(zip(names, node_attrs))
+    for (u, v), strength, attrs in zip(arrays['edge_index'].tolist(), arrays['edge_strength'].tolist(), edge_attrs):
+        graph.add_edge(names[u], names[v], strength=None if math.isnan(strength) else strength, **attrs)
+    return graph
+
+class VideoStore:
+    '''On-disk store for per-video transcripts, chunks, graphs and summaries'''
+
+    def __init__(self, root=VIDEO_STORE_DIR):
+        self.root = root
+
+    def _path(self, video_id, name):
+        return os.path.join(self.root, video_id, name)
+
+    def _write(self, video_id, name, data):
+        '''Write a file atomically so readers never see partial artifacts'''
+        path = self._path(video_id, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        mode = 'wb' if isinstance(data, bytes) else 'w'
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read(self, video_id, name, binary=False):
+        path = self._path(video_id, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb' if binary else 'r') as f:
+            return f.read()
+
+    def load_manifest(self, video_id):
+        '''Load the manifest recording which artifacts exist and their versions'''
+        manifest = self._read(video_id, 'manifest.json')
+        return json.loads(manifest) if manifest else {}
+
+    def _update_manifest(self, video_id, section, **info):
+        manifest = self.load_manifest(video_id)
+        manifest[section] = dict(info, saved_at=time.time())
+        self._write(video_id, 'manifest.json', json.dumps(manifest, indent=2))
+
+    def save_transcript(self, video_id, video_text, segments=None):
+        '''Save the transcript of a video and its timestamped segments'''
+        self._write(video_id, 'transcript.txt', video_text)
+        if segments is not None:
+            self._write(video_id, 'segments.json', json.dumps(segments))
+        self._update_manifest(video_id, 'transcript', version=TRANSCRIPT_VERSION)
+
+    def load_transcript(self, video_id):
+        '''Load the transcript, or None if missing or built by an older pipeline'''
+        if self.load_manifest(video_id).get('transcript', {}).get('version') != TRANSCRIPT_VERSION:
+            return None
+        return self._read(video_id, 'transcript.txt')
+
+    def load_segments(self, video_id):
+        '''Load the timestamped transcript segments, or None if missing'''
+        if self.load_transcript(video_id) is None:
+            return None
+        segments = self._read(video_id, 'segments.json')
+        return json.loads(segments) if segments else None
+
+    def save_graph(self, video_id, graph, summary, chunks=None, model=None):
+        '''Save the knowledge graph, summary and transcript chunks of a video'''
+        self._write(video_id, 'graph.npz', graph_to_npz(graph))
+        self._write(video_id, 'summary.md', summary or '')
+        if chunks is not None:
+            self._write(video_id, 'chunks.json', json.dumps(chunks))
+        self._update_manifest(video_id, 'graph', version=PIPELINE_VERSION, model=model,
+                              nodes=graph.number_of_nodes(), edges=graph.number_of_edges())
+
+    def load_graph(self, video_id, model=None):
+        '''Load (graph, summary), or None if missing, stale or built with another model'''
+        info = self.load_manifest(video_id).get('graph', {})
+        if info.get('version') != PIPELINE_VERSION or (model is not None and info.get('model') != model):
+            return None
+        data = self._read(video_id, 'graph.npz', binary=True)
+        if data is None:
+            return None
+        return graph_from_npz(data), self._read(video_id, 'summary.md')
+
+    def load_chunks(self, video_id):
+        '''Load the transcript chunks of a video'''
+        chunks = self._read(video_id, 'chunks.json')
+        return json.loads(chunks) if chunks else None
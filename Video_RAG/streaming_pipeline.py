@@ -0,0 +1,206 @@
+import os
+import wave
+import asyncio
+import tempfile
+import networkx as nx
+from rag_utils import segment_tokens, segments_to_document
+from transcribe import get_backend
+from download_manager import DownloadError, get_audio_stream
+from entity_resolution import resolve_entities
+from entity_index import get_embedder
+from tracing import traced
+from background import get_background_loop
+from graph_rag import generate_domain, discover_entity_types, extract_chunk, add_to_knowledge_graph, generate_summary, chunk_span
+from config import LLM_CACHE_ENABLED, STREAM_CONTEXT_CHUNKS, EXTRACTION_WINDOW, ENTITY_RESOLUTION, ENTITY_RESOLUTION_EMBEDDINGS, \
+    STREAM_SEGMENT_SECONDS, STREAM_QUEUE_SIZE, CHUNK_TOKENS
+
+def wav_duration(path):
+    '''Duration of a wav file in seconds'''
+    with wave.open(path) as f:
+        return f.getnframes() / f.getframerate()
+
+async def stream_audio_segments(source, out_dir, segment_seconds=STREAM_SEGMENT_SECONDS):
+    '''Decode audio from a URL or file with ffmpeg while it downloads, yielding (path, offset) per completed segment'''
+    pattern = os.path.join(out_dir, 'segment_%05d.wav')
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-nostdin', '-loglevel', 'error', '-i', source, '-vn', '-ac', '1', '-ar', '16000',
+        '-f', 'segment', '-segment_time', str(segment_seconds), pattern, stderr=asyncio.subprocess.PIPE)
+
+    index = 0
+    offset = 0.0
+    try:
+        while True:
+            finished = process.returncode is not None
+            # A segment is complete once ffmpeg has started the next one or exited
+            while os.path.exists(pattern % (index + 1)) or (finished and os.path.exists(pattern % index)):
+                path = pattern % index
+                duration = wav_duration(path)
+                yield path, offset
+                offset += duration
+                index += 1
+            if finished:
+                break
+            try:
+                await asyncio.wait_for(process.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+
+        if process.returncode != 0:
+            error = (await process.stderr.read()).decode('utf-8', 'ignore')
+            # Reading a remote stream fails on network errors, which the UI reports as download errors
+            error_type = RuntimeError if os.path.exists(source) else DownloadError
+            raise error_type(f"ffmpeg failed with code {process.returncode}: {error}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+async def run_streaming_pipeline(llm, source, use_cache=LLM_CACHE_ENABLED, on_progress=None, resolve=ENTITY_RESOLUTION):
+    '''Overlap download, transcription and extraction through bounded queues, returning (transcript, summary, graph)'''
+    loop = asyncio.get_running_loop()
+    segment_queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    text_queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    chunk_queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    transcript_segments = []
+    graph = nx.Graph()
+    progress = {'chunks_done': 0, 'chunks_failed': 0, 'chunks_total': 0}
+
+    def emit(event, **data):
+        if on_progress:
+            on_progress(dict(data, event=event))
+
+    if not os.path.exists(source):
+        # Resolve the stream like the download manager, so failures surface as download errors
+        stream = await loop.run_in_executor(None, get_audio_stream, source)
+        source = stream.url
+    backend = await loop.run_in_executor(None, get_backend)
+
+    async def download(out_dir):
+        '''Stage 1: decode audio segments as the stream downloads'''
+        cancelled = False
+        try:
+            with traced('download', streamed=True):
+                async for path, offset in stream_audio_segments(source, out_dir):
+                    await segment_queue.put((path, offset))
+                    emit('audio_segment', offset=offset)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # A cancelled pipeline has no consumer left, so waiting on a full queue would never end
+            if not cancelled:
+                await segment_queue.put(None)
+
+    async def transcribe(executor):
+        '''Stage 2: transcribe each audio segment as it arrives'''
+        cancelled = False
+        try:
+            while (item := await segment_queue.get()) is not None:
+                path, offset = item
+                with traced('transcription', offset=offset):
+                    result = await loop.run_in_executor(executor, backend.transcribe, path)
+                os.remove(path)
+                segments = [dict(segment, start=segment['start'] + offset, end=segment['end'] + offset) for segment in result['segments']]
+                transcript_segments.extend(segments)
+                await text_queue.put(segments)
+                emit('transcript', seconds=segments[-1]['end'] if segments else offset)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                await text_queue.put(None)
+
+    async def chunk():
+        '''Stage 3: cut transcript chunks on segment boundaries as soon as they are full'''
+        pending, pending_tokens = [], 0
+        cancelled = False
+        try:
+            while (segments := await text_queue.get()) is not None:
+                for segment in segments:
+                    tokens = segment_tokens(segment)
+                    if pending and pending_tokens + tokens > CHUNK_TOKENS:
+                        await chunk_queue.put(segments_to_document(pending))
+                        pending, pending_tokens = [], 0
+                    pending.append(segment)
+                    pending_tokens += tokens
+            if pending:
+                await chunk_queue.put(segments_to_document(pending))
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                await chunk_queue.put(None)
+
+    async def extract():
+        '''Stage 4: derive the entity types from the first chunks, then extract and merge every chunk'''
+        context_docs = []
+        while len(context_docs) < STREAM_CONTEXT_CHUNKS and (doc := await chunk_queue.get()) is not None:
+            context_docs.append(doc)
+        end_of_stream = len(context_docs) < STREAM_CONTEXT_CHUNKS
+        if not context_docs:
+            return
+
+        domain = await generate_domain(llm, context_docs, use_cache=use_cache)
+        emit('domain', domain=domain)
+        entity_types = await discover_entity_types(llm, context_docs, domain, use_cache=use_cache)
+        emit('entity_types', entity_types=entity_types)
+        graph.graph.update(domain=domain, entity_types=entity_types)
+
+        async def extract_and_merge(index, doc):
+            try:
+                extracted_data = await extract_chunk(llm, doc, entity_types, use_cache=use_cache)
+            except Exception as e:
+                # One bad chunk should not abort the whole stream
+                progress['chunks_failed'] += 1
+                emit('chunk_failed', chunk_index=index, error=str(e), **progress)
+                return
+            add_to_knowledge_graph(graph, extracted_data, span=chunk_span(doc))
+            progress['chunks_done'] += 1
+            emit('chunk_done', nodes=graph.number_of_nodes(), edges=graph.number_of_edges(), graph=graph, **progress)
+
+        def start(doc):
+            tasks.add(asyncio.ensure_future(extract_and_merge(progress['chunks_total'], doc)))
+            progress['chunks_total'] += 1
+
+        tasks = set()
+        try:
+            for doc in context_docs:
+                start(doc)
+            while not end_of_stream and (doc := await chunk_queue.get()) is not None:
+                if len(tasks) >= EXTRACTION_WINDOW:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                start(doc)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Transcribe on the shared CPU pool, so sessions never run the shared model concurrently beyond BACKGROUND_CPU_WORKERS
+    executor = get_background_loop().cpu_executor
+    with tempfile.TemporaryDirectory() as out_dir:
+        stages = [asyncio.ensure_future(stage) for stage in (download(out_dir), transcribe(executor), chunk(), extract())]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for stage in stages:
+                stage.cancel()
+            # Let the stages unwind before the temporary directory is removed
+            await asyncio.gather(*stages, return_exceptions=True)
+
+    transcript = {'text': ''.join(segment['text'] for segment in transcript_segments), 'segments': transcript_segments}
+
+    # Merge duplicate entities and summarize once every chunk is in the graph
+    if resolve:
+        embedder = get_embedder() if ENTITY_RESOLUTION_EMBEDDINGS else None
+        with traced('resolution'):
+            graph, report = resolve_entities(graph, embedder=embedder)
+        emit('resolution', **report)
+    on_token = (lambda token: emit('summary_token', token=token)) if on_progress else None
+    summary = await generate_summary(llm, graph, use_cache=use_cache, on_token=on_token)
+    emit('done', summary=summary, graph=graph)
+    return transcript, summary, graph
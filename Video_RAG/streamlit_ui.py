@@ -1,4 +1,5 @@
 import streamlit as st
+from video_downloader import get_video_id
 
 def set_custom_style():
     st.markdown("""
@@ -76,6 +77,19 @@ def display_sidebar(models_dict):
                 st.session_state["api_key"] = api_key
         else:
             st.session_state["api_key"] = None
+
+        st.session_state["query_mode"] = st.radio(
+            "Question scope",
+            ["local", "global"],
+            format_func=lambda mode: {"local": "Specific (entities)", "global": "Broad (topic summaries)"}[mode],
+            help="Specific questions use the entities closest to the query, broad questions use the summaries of every topic in the video"
+        )
+
+        st.session_state["skip_entity_selection"] = st.checkbox(
+            "Fast retrieval",
+            value=False,
+            help="Answer from the closest entities in the vector index without an extra LLM call to select them"
+        )
         
         st.markdown("### ℹ️ About")
         st.markdown("""
@@ -95,6 +109,16 @@ def display_video(video_url):
         with col1:
             st.video(video_url)
     
+def is_video_url(video_url):
+    # Accept only YouTube URLs a video ID can be extracted from
+    if "youtu" not in video_url:
+        return False
+    try:
+        get_video_id(video_url)
+        return True
+    except ValueError:
+        return False
+
 def display_video_section(api_key_required):
     st.markdown("### 🎬 Video Input")
     
@@ -116,6 +140,7 @@ def display_video_section(api_key_required):
         st.session_state["summary"] = None
         st.session_state["graph"] = None
         st.session_state["video_text"] = None
+        st.session_state["job_id"] = None
         st.session_state["history"] = []
         
     # Keep the video displayed if summary is available
@@ -123,7 +148,7 @@ def display_video_section(api_key_required):
         display_video(video_url)
 
     if video_url and process_button:
-        if "youtu" in video_url:
+        if is_video_url(video_url):
             if api_key_required and not st.session_state.get("api_key"):
                 st.error("Please enter your API key in the sidebar first!")
             else:   
@@ -139,6 +164,67 @@ def display_summary(summary):
         with st.expander("View Summary", expanded=True):
             st.chat_message(name="Assistant").write(summary)
 
+def display_pipeline_progress():
+    # Create a progress bar and a placeholder for the preview summary
+    progress_bar = st.progress(0.0, text="Splitting transcript ...")
+    preview = st.empty()
+    summary_text = []
+
+    def on_progress(event):
+        if event['event'] == 'stage':
+            progress_bar.progress(0.0, text=event['message'])
+        elif event['event'] == 'transcript':
+            minutes, seconds = divmod(int(event['seconds']), 60)
+            progress_bar.progress(0.0, text=f"Transcribed {minutes}:{seconds:02d} of audio ...")
+        elif event['event'] == 'domain':
+            progress_bar.progress(0.0, text=f"Domain: {event['domain']}")
+        elif event['event'] == 'entity_types':
+            progress_bar.progress(0.0, text=f"Found {len(event['entity_types'])} entity types, extracting ...")
+        elif event['event'] == 'chunk_done':
+            progress_bar.progress((event['chunks_done'] + event.get('chunks_failed', 0)) / event['chunks_total'],
+                                  text=f"Chunks {event['chunks_done']}/{event['chunks_total']} · {event['nodes']} entities · {event['edges']} relationships")
+        elif event['event'] == 'chunk_failed':
+            st.warning(f"Chunk {event['chunk_index'] + 1} could not be extracted, the graph is not saved so processing the video again retries it: {event['error']}")
+        elif event['event'] == 'resolution':
+            progress_bar.progress(1.0, text=f"Merged duplicate entities: {event['nodes_before']} → {event['nodes_after']} entities")
+        elif event['event'] == 'summary_token':
+            summary_text.append(event['token'])
+            progress_bar.progress(1.0, text="Writing summary ...")
+            preview.chat_message(name="Assistant").write(''.join(summary_text))
+        elif event['event'] == 'partial_summary':
+            with preview.expander("Preview Summary (partial)", expanded=False):
+                st.write(event['summary'])
+        elif event['event'] == 'done':
+            progress_bar.empty()
+            preview.empty()
+
+    return on_progress
+
+def display_query_cache_stats(stats):
+    # Show how often repeated questions were answered from the query cache
+    with st.sidebar.expander("📊 Query cache"):
+        col1, col2 = st.columns(2)
+        col1.metric("Hit rate", f"{stats['hit_rate']:.0%}")
+        col2.metric("LLM time saved", f"{stats['seconds_saved']:.1f}s")
+        st.caption(f"Answers: {stats['hits'].get('answer', 0)} hits / {stats['misses'].get('answer', 0)} misses · "
+                   f"Selections: {stats['hits'].get('selection', 0)} hits / {stats['misses'].get('selection', 0)} misses · "
+                   f"{stats['semantic_hits']} near-duplicate hits")
+
+def display_trace_summary(stages):
+    # Show where pipeline and chat time and tokens went, per stage including its sub-stages
+    with st.sidebar.expander("⏱️ Pipeline trace"):
+        if not stages:
+            st.caption("No traced stages yet")
+            return
+        st.dataframe(
+            [{"Stage": stage['stage'], "Runs": stage['count'], "Total (s)": round(stage['seconds'], 2),
+              "Mean (s)": round(stage['mean_seconds'], 2), "Max (s)": round(stage['max_seconds'], 2),
+              "LLM calls": stage['llm_calls'], "Prompt tokens": stage['prompt_tokens'], "Completion tokens": stage['completion_tokens'],
+              "Retries": stage['retries'], "Cache hits": stage['cache_hits'] + stage['query_cache_hits'], "Errors": stage['errors']}
+             for stage in stages],
+            hide_index=True
+        )
+
 def display_chat_interface():
     # Display chat messages
     if "history" not in st.session_state:
@@ -164,6 +250,10 @@ def take_user_query():
             st.chat_message(name="User").write(message)
             return message
 
+def display_response_stream(tokens):
+    # Write the response as its tokens arrive, returning the full text
+    return st.chat_message(name="Assistant").write_stream(tokens)
+
 def display_response(response):
     if response:
         # display the response
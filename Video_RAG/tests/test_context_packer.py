@@ -0,0 +1,43 @@
+import os
+import sys
+import subprocess
+
+# Packs a graph whose nodes come from a set, in a fresh interpreter, with a whitespace tokenizer so no encoding is downloaded
+PACK_SCRIPT = '''
+import networkx as nx
+import context_packer
+
+class WhitespaceEncoding:
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+context_packer.get_encoding = lambda name=None: WhitespaceEncoding()
+
+graph = nx.Graph()
+for i in range(40):
+    graph.add_node(f"entity_{i}", type="concept", description=f"description of entity {i}")
+for i in range(40):
+    for j in (i + 1, i + 3, i + 6):
+        if j < 40:
+            graph.add_edge(f"entity_{i}", f"entity_{j}", relationship=f"link {i}-{j}", strength=5, count=1)
+
+# Fewer than half the nodes, so a subgraph view would iterate the node set
+nodes = sorted(f"entity_{i}" for i in range(0, 40, 3))
+entity_list, relationship_list = context_packer.pack_context(graph, 400, nodes=nodes)
+print(entity_list)
+print(relationship_list)
+'''
+
+def pack_with_hash_seed(seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(seed))
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run([sys.executable, '-c', PACK_SCRIPT], cwd=cwd, env=env, capture_output=True, text=True, check=True).stdout
+
+def test_pack_context_is_independent_of_hash_seed():
+    first = pack_with_hash_seed(1)
+    assert '--' in first
+    for seed in (2, 3, 4):
+        assert pack_with_hash_seed(seed) == first
@@ -0,0 +1,44 @@
+import networkx as nx
+from entity_resolution import resolve_entities
+
+def test_same_name_with_different_types_is_not_merged():
+    graph = nx.Graph()
+    graph.add_node('Apple', type='ORGANIZATION', description='Company that makes the iPhone')
+    graph.add_node('apple', type='CONCEPT', description='A fruit')
+    graph.add_node('APPLE', description='Mentioned without a type')
+    graph.add_edge('Apple', 'apple', relationship='named after')
+
+    resolved, report = resolve_entities(graph)
+
+    assert report['merged_groups'] == 1
+    assert {resolved.nodes[name]['type'] for name in resolved} == {'ORGANIZATION', 'CONCEPT'}
+    assert resolved.number_of_edges() == 1
+
+def test_existing_self_loops_are_kept():
+    graph = nx.Graph()
+    graph.add_node('Recursion', type='CONCEPT')
+    graph.add_node('Python', type='LANGUAGE')
+    graph.add_edge('Recursion', 'Recursion', relationship='defined in terms of itself')
+    graph.add_edge('Recursion', 'Python', relationship='used in')
+
+    resolved, report = resolve_entities(graph)
+
+    assert report['merged_groups'] == 0
+    assert report['merged_edges'] == 0
+    assert report['edges_after'] == report['edges_before'] == 2
+    assert resolved.has_edge('Recursion', 'Recursion')
+
+def test_edges_between_merged_duplicates_are_dropped():
+    graph = nx.Graph()
+    for name in ('GPT-4', 'gpt4', 'OpenAI'):
+        graph.add_node(name, type='MODEL' if name != 'OpenAI' else 'ORGANIZATION')
+    graph.add_edge('GPT-4', 'gpt4', relationship='same as')
+    graph.add_edge('GPT-4', 'OpenAI', relationship='made by')
+    graph.add_edge('gpt4', 'OpenAI', relationship='released by')
+
+    resolved, report = resolve_entities(graph)
+
+    assert report['merged_groups'] == 1
+    assert report['merged_edges'] == 2
+    assert resolved.number_of_edges() == 1
+    assert nx.number_of_selfloops(resolved) == 0
@@ -0,0 +1,39 @@
+import asyncio
+import networkx as nx
+import context_packer
+import graph_rag
+
+class WhitespaceEncoding:
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+def make_segments(count, offset=0.03, seconds=7.4):
+    # Segment times that are not multiples of 0.1 s, unlike the rounded spans stored on the graph
+    return [{'start': offset + i * seconds, 'end': offset + (i + 1) * seconds, 'text': f" words of segment {i}" * 20} for i in range(count)]
+
+def test_reprocess_time_range_replaces_entities_of_boundary_chunks(monkeypatch):
+    monkeypatch.setattr(context_packer, 'get_encoding', lambda name=None: WhitespaceEncoding())
+    segments = make_segments(20)
+    doc_splits = graph_rag.split_segments(segments, chunk_size=160)
+    assert len(doc_splits) > 2
+
+    graph = nx.Graph(entity_types=['concept'])
+    for i, doc in enumerate(doc_splits):
+        graph_rag.add_to_knowledge_graph(graph, {'entities': [{'name': f"A{i}", 'type': 'concept'}, {'name': f"B{i}", 'type': 'concept'}],
+                                                 'relationships': [{'source': f"A{i}", 'target': f"B{i}", 'relationship': 'related'}]},
+                                         span=graph_rag.chunk_span(doc))
+
+    # The re-extraction finds nothing, so every entity of the range must be gone
+    async def extract_nothing(llm, docs, entity_types, use_cache=True, retries=0):
+        return [({'entities': [], 'relationships': []}, None) for _ in docs]
+    monkeypatch.setattr(graph_rag, 'extract_chunks', extract_nothing)
+
+    end = doc_splits[1].metadata['end']
+    asyncio.run(graph_rag.reprocess_time_range(None, graph, segments, 0, end))
+
+    assert not {'A0', 'B0', 'A1', 'B1'} & set(graph.nodes)
+    assert {'A2', 'B2'} <= set(graph.nodes)
+    assert not graph.has_edge('A0', 'B0')
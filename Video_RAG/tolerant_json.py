@@ -0,0 +1,193 @@
+import re
+import json
+
+FENCE_PATTERN = re.compile(r'```[a-zA-Z]*\s*\n?(.*?)(?:```|$)', re.DOTALL)
+NUMBER_PATTERN = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '/': '/', '\\': '\\', '"': '"', "'": "'"}
+WHITESPACE = ' \t\r\n'
+_MISSING = object()
+
+class _Parser:
+    '''Single-pass recursive descent parser that repairs common LLM JSON mistakes'''
+
+    def __init__(self, text):
+        self.text = text
+        self.i = 0
+        self.n = len(text)
+        self.truncated = False
+        self.unclosed = set()
+
+    def skip(self):
+        '''Skip whitespace and // or /* */ comments'''
+        text, n = self.text, self.n
+        while self.i < n:
+            c = text[self.i]
+            if c in WHITESPACE:
+                self.i += 1
+            elif text.startswith('//', self.i):
+                end = text.find('\n', self.i)
+                self.i = n if end == -1 else end + 1
+            elif text.startswith('/*', self.i):
+                end = text.find('*/', self.i + 2)
+                self.i = n if end == -1 else end + 2
+            else:
+                break
+
+    def value(self):
+        '''Parse any value, returning _MISSING if the text ends before it starts'''
+        self.skip()
+        if self.i >= self.n:
+            self.truncated = True
+            return _MISSING
+        c = self.text[self.i]
+        if c == '{':
+            return self.object()
+        if c == '[':
+            return self.array()
+        if c in '"\'':
+            return self.string()
+        match = NUMBER_PATTERN.match(self.text, self.i)
+        if match and (match.end() >= self.n or self.text[match.end()] in WHITESPACE + ',]}'):
+            self.i = match.end()
+            number = match.group()
+            return float(number) if any(ch in number for ch in '.eE') else int(number)
+        word = self.bare_word()
+        return LITERALS.get(word, word)
+
+    def bare_word(self, stop=',]}\n'):
+        '''Read an unquoted token up to the next delimiter'''
+        start = self.i
+        while self.i < self.n and self.text[self.i] not in stop:
+            self.i += 1
+        return self.text[start:self.i].strip()
+
+    def string(self):
+        '''Parse a quoted string, keeping quotes that are not followed by a delimiter as literal text'''
+        text, n = self.text, self.n
+        quote = text[self.i]
+        self.i += 1
+        parts = []
+        start = self.i
+        while self.i < n:
+            c = text[self.i]
+            if c == '\\':
+                parts.append(text[start:self.i])
+                escape = text[self.i + 1:self.i + 2]
+                if escape == 'u' and self.i + 6 <= n:
+                    try:
+                        parts.append(chr(int(text[self.i + 2:self.i + 6], 16)))
+                        self.i += 6
+                    except ValueError:
+                        parts.append(escape)
+                        self.i += 2
+                else:
+                    parts.append(ESCAPES.get(escape, escape))
+                    self.i += 2
+                start = self.i
+            elif c == quote:
+                # An unescaped quote inside a value is not followed by a delimiter
+                j = self.i + 1
+                while j < n and text[j] in WHITESPACE:
+                    j += 1
+                if j >= n or text[j] in ',:]}':
+                    parts.append(text[start:self.i])
+                    self.i += 1
+                    return ''.join(parts)
+                self.i += 1
+            else:
+                self.i += 1
+        self.truncated = True
+        parts.append(text[start:n])
+        return ''.join(parts)
+
+    def object(self):
+        '''Parse an object, tolerating trailing or missing commas and a missing closing brace'''
+        self.i += 1
+        result = {}
+        while True:
+            self.skip()
+            if self.i >= self.n:
+                self.truncated = True
+                self.unclosed.add(id(result))
+                return result
+            c = self.text[self.i]
+            if c == '}':
+                self.i += 1
+                return result
+            if c == ',':
+                self.i += 1
+                continue
+            if c == ']':
+                # Mismatched bracket, treat it as the end of the object
+                return result
+
+            key = self.string() if c in '"\'' else self.bare_word(stop=':,}\n')
+            self.skip()
+            if self.i < self.n and self.text[self.i] == ':':
+                self.i += 1
+            value = self.value()
+            if value is _MISSING:
+                self.unclosed.add(id(result))
+                return result
+            result[str(key)] = value
+
+    def array(self):
+        '''Parse an array, tolerating trailing or missing commas and a missing closing bracket'''
+        self.i += 1
+        result = []
+        while True:
+            self.skip()
+            if self.i >= self.n:
+                self.truncated = True
+                return result
+            c = self.text[self.i]
+            if c == ']':
+                self.i += 1
+                return result
+            if c == ',':
+                self.i += 1
+                continue
+            if c == '}':
+                return result
+
+            value = self.value()
+            if value is _MISSING:
+                return result
+            result.append(value)
+
+def strip_fences(text):
+    '''Return the contents of the first markdown code fence, or the text itself'''
+    match = FENCE_PATTERN.search(text)
+    return match.group(1) if match else text
+
+def parse_json(text, drop_truncated_items=True):
+    '''Parse JSON from LLM output, repairing code fences, surrounding prose, trailing commas, quotes and truncation'''
+    if isinstance(text, (dict, list)):
+        return text
+    text = strip_fences(str(text))
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        raise ValueError(f"No JSON object found in: {text[:100]!r}")
+    text = text[min(starts):]
+
+    # Well-formed output takes the fast C parser
+    try:
+        return json.JSONDecoder().raw_decode(text)[0]
+    except ValueError:
+        pass
+
+    parser = _Parser(text)
+    result = parser.value()
+    if parser.truncated and drop_truncated_items:
+        drop_unclosed(result, parser.unclosed)
+    return result
+
+def drop_unclosed(value, unclosed):
+    '''Remove the objects cut off by truncation from the lists along the end of the output'''
+    while isinstance(value, (dict, list)) and value:
+        last = value[-1] if isinstance(value, list) else value[next(reversed(value))]
+        if isinstance(value, list) and id(last) in unclosed:
+            value.pop()
+            return
+        value = last
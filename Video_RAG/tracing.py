@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from config import TRACING_ENABLED, TRACE_EXPORTER, TRACE_PATH, TRACE_BUFFER_SIZE
+
+# Counters summed per span and rolled up into every ancestor when a span ends
+COUNTERS = ('prompt_tokens', 'completion_tokens', 'llm_calls', 'retries', 'cache_hits', 'cache_misses', 'query_cache_hits')
+
+_current_span = contextvars.ContextVar('videorag_span', default=None)
+
+class Span:
+    '''A timed pipeline stage with attributes, own counters and counters rolled up from its children'''
+
+    def __init__(self, tracer, name, parent=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = dict(attributes or {})
+        self.counters = {}
+        self.totals = {}
+        self.error = None
+        self.start = time.time()
+        self.end_time = None
+        self._lock = threading.Lock()
+
+    @property
+    def seconds(self):
+        return (self.end_time or time.time()) - self.start
+
+    def set(self, **attributes):
+        '''Set attributes of the span'''
+        self.attributes.update(attributes)
+
+    def incr(self, counter, amount=1):
+        '''Add to a counter of the span'''
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+            self.totals[counter] = self.totals.get(counter, 0) + amount
+
+    def end(self, error=None):
+        '''Finish the span, rolling its totals up into the parent and exporting it'''
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self.parent is not None:
+            with self.parent._lock:
+                for counter, amount in self.totals.items():
+                    self.parent.totals[counter] = self.parent.totals.get(counter, 0) + amount
+        self.tracer._finish(self)
+
+    def to_dict(self):
+        '''Serialize the span with OpenTelemetry field names'''
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent.span_id if self.parent is not None else None,
+            'name': self.name,
+            'startTimeUnixNano': int(self.start * 1e9),
+            'endTimeUnixNano': int(self.end_time * 1e9) if self.end_time else None,
+            'attributes': dict(self.attributes, **self.counters),
+            'status': {'code': 'ERROR', 'message': self.error} if self.error else {'code': 'OK'},
+        }
+
+class JsonLinesExporter:
+    '''Append finished spans to a JSON lines file'''
+
+    def __init__(self, path=TRACE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line)
+
+class OpenTelemetryExporter:
+    '''Mirror spans into the OpenTelemetry SDK, exported by whatever span processors the application configured'''
+
+    def __init__(self):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("opentelemetry-api and opentelemetry-sdk are required for the otel exporter: pip install opentelemetry-sdk")
+        self.trace = trace
+        self.tracer = trace.get_tracer('videorag')
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def on_start(self, span):
+        with self._lock:
+            parent = self._spans.get(span.parent.span_id) if span.parent is not None else None
+        context = self.trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = self.tracer.start_span(span.name, context=context, start_time=int(span.start * 1e9))
+        with self._lock:
+            self._spans[span.span_id] = otel_span
+
+    def on_end(self, span):
+        with self._lock:
+            otel_span = self._spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        for key, value in span.to_dict()['attributes'].items():
+            otel_span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+        if span.error:
+            otel_span.set_status(self.trace.Status(self.trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=int(span.end_time * 1e9))
+
+EXPORTERS = {
+    'jsonl': JsonLinesExporter,
+    'otel': OpenTelemetryExporter,
+}
+
+class Tracer:
+    '''Create spans, keep the most recent finished ones in memory and hand them to an exporter'''
+
+    def __init__(self, exporter=None, enabled=TRACING_ENABLED, buffer_size=TRACE_BUFFER_SIZE):
+        self.exporter = exporter
+        self.enabled = enabled
+        self.finished = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    def start_span(self, name, parent=None, **attributes):
+        '''Start a span without making it current, for stages that span yields of an async generator'''
+        span = Span(self, name, parent if parent is not None else _current_span.get(), attributes)
+        if self.enabled and self.exporter is not None:
+            self.exporter.on_start(span)
+        return span
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        '''Time a block as a span, the parent of spans started inside it, including in tasks it creates'''
+        span = self.start_span(name, parent=parent, **attributes)
+        with use_span(span):
+            try:
+                yield span
+            except BaseException as e:
+                span.end(error=e)
+                raise
+            finally:
+                span.end()
+
+    def _finish(self, span):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.finished.append(span)
+        if self.exporter is not None:
+            try:
+                self.exporter.on_end(span)
+            except Exception as e:
+                print(f"WARNING: exporting span {span.name} failed: {type(e).__name__}: {e}")
+
+    def summary(self, trace_id=None):
+        '''Aggregate finished spans per stage: count, wall time and counters including their children'''
+        with self._lock:
+            spans = [span for span in self.finished if trace_id is None or span.trace_id == trace_id]
+        stages = {}
+        for span in spans:
+            stage = stages.setdefault(span.name, dict({'stage': span.name, 'count': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0},
+                                                      **{counter: 0 for counter in COUNTERS}))
+            stage['count'] += 1
+            stage['errors'] += span.error is not None
+            stage['seconds'] += span.seconds
+            stage['max_seconds'] = max(stage['max_seconds'], span.seconds)
+            for counter, amount in span.totals.items():
+                stage[counter] = stage.get(counter, 0) + amount
+        for stage in stages.values():
+            stage['mean_seconds'] = stage['seconds'] / stage['count']
+        return sorted(stages.values(), key=lambda stage: -stage['seconds'])
+
+def current_span():
+    '''Get the span of the running block, or None'''
+    return _current_span.get()
+
+@contextmanager
+def use_span(span):
+    '''Make a started span current for a block without ending it'''
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+def incr(counter, amount=1, span=None):
+    '''Add to a counter of the given or the current span, if any'''
+    span = span or _current_span.get()
+    if span is not None:
+        span.incr(counter, amount)
+
+_default_tracer = None
+_default_tracer_lock = threading.Lock()
+
+def get_tracer():
+    '''Get the process-wide tracer'''
+    global _default_tracer
+    with _default_tracer_lock:
+        if _default_tracer is None:
+            exporter = EXPORTERS[TRACE_EXPORTER]() if TRACING_ENABLED and TRACE_EXPORTER else None
+            _default_tracer = Tracer(exporter)
+    return _default_tracer
+
+def traced(name, parent=None, **attributes):
+    '''Time a block as a span of the process-wide tracer'''
+    return get_tracer().span(name, parent=parent, **attributes)
+
+def start_span(name, parent=None, **attributes):
+    '''Start a span of the process-wide tracer without making it current'''
+    return get_tracer().start_span(name, parent=parent, **attributes)
@@ -1,12 +1,147 @@
-import whisper
+import os
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import TRANSCRIPTION_BACKEND, WHISPER_MODEL, TRANSCRIPTION_THREADS, FASTER_WHISPER_COMPUTE_TYPE, \
+    PARALLEL_TRANSCRIPTION_MIN_SECONDS, PARALLEL_TRANSCRIPTION_WORKERS, PARALLEL_WINDOW_SECONDS, PARALLEL_OVERLAP_SECONDS
+
+class TranscriptionBackend:
+    '''Interface for speech-to-text engines'''
+    name = None
+
+    def transcribe(self, audio_file):
+        '''Transcribe an audio file into {'text': ..., 'segments': [{'start', 'end', 'text', 'tokens'}]}'''
+        raise NotImplementedError
+
+class WhisperBackend(TranscriptionBackend):
+    '''Reference openai-whisper engine'''
+    name = 'whisper'
+
+    def __init__(self, model_name=WHISPER_MODEL, threads=TRANSCRIPTION_THREADS, device=None):
+        import whisper
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = whisper.load_model(model_name, device=device)
+
+    def transcribe(self, audio_file):
+        result = self.model.transcribe(audio_file)
+        segments = [{'start': s['start'], 'end': s['end'], 'text': s['text'], 'tokens': s['tokens']} for s in result['segments']]
+        return {'text': result['text'], 'segments': segments}
+
+class FasterWhisperBackend(TranscriptionBackend):
+    '''CTranslate2 engine with int8 quantized CPU inference'''
+    name = 'faster_whisper'
+
+    def __init__(self, model_name=WHISPER_MODEL, threads=TRANSCRIPTION_THREADS, device='cpu', compute_type=FASTER_WHISPER_COMPUTE_TYPE):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise ImportError("faster-whisper is required for this backend: pip install faster-whisper")
+        self.model = WhisperModel(model_name, device=device, compute_type=compute_type, cpu_threads=threads or 0)
+
+    def transcribe(self, audio_file):
+        segments, info = self.model.transcribe(audio_file, beam_size=5)
+        segments = [{'start': s.start, 'end': s.end, 'text': s.text, 'tokens': list(s.tokens)} for s in segments]
+        return {'text': ''.join(s['text'] for s in segments), 'segments': segments}
+
+BACKENDS = {
+    'whisper': WhisperBackend,
+    'faster_whisper': FasterWhisperBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name=TRANSCRIPTION_BACKEND, model_name=WHISPER_MODEL, **options):
+    '''Get a transcription backend, loading its model once per process'''
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown transcription backend: {name}")
+    key = (name, model_name, tuple(sorted(options.items())))
+    with _backends_lock:
+        if key not in _backends:
+            print(f"Loading {name} model: {model_name}")
+            _backends[key] = BACKENDS[name](model_name, **options)
+        return _backends[key]
 
 def load_whisper(model_name):
     '''Load the whisper model'''
-    model = whisper.load_model(model_name)
-    return model
+    return get_backend('whisper', model_name).model
 
 def transcribe_audio(model, audio_file):
     '''Transcribe the audio file'''
+    if isinstance(model, TranscriptionBackend):
+        return model.transcribe(audio_file)['text']
     result = model.transcribe(audio_file)
     video_text = result["text"]
-    return video_text
\ No newline at end of file
+    return video_text
+
+def find_cut_point(audio, target_ms, search_ms=5000):
+    '''Find the middle of the longest silence near target_ms, or target_ms if there is none'''
+    from pydub.silence import detect_silence
+    start = max(0, target_ms - search_ms)
+    region = audio[start:target_ms + search_ms]
+    silences = detect_silence(region, min_silence_len=300, silence_thresh=audio.dBFS - 16)
+    if not silences:
+        return target_ms
+    silence_start, silence_end = max(silences, key=lambda s: s[1] - s[0])
+    return start + (silence_start + silence_end) // 2
+
+def split_audio(audio_file, out_dir, window_s=PARALLEL_WINDOW_SECONDS, overlap_s=PARALLEL_OVERLAP_SECONDS):
+    '''Split audio into windows cut on silence with small overlaps, returning (path, offset, keep_from, keep_until) per window'''
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(audio_file).set_channels(1).set_frame_rate(16000)
+    window_ms, overlap_ms = int(window_s * 1000), int(overlap_s * 1000)
+
+    windows = []
+    start = 0
+    while start < len(audio):
+        cut = len(audio) if len(audio) - start <= window_ms * 1.2 else find_cut_point(audio, start + window_ms)
+        offset = max(0, start - overlap_ms)
+        path = os.path.join(out_dir, f"window_{len(windows):04d}.wav")
+        audio[offset:min(len(audio), cut + overlap_ms)].export(path, format='wav')
+        # Segments are kept by the window their midpoint falls in, between the previous and this cut
+        windows.append((path, offset / 1000, start / 1000, cut / 1000))
+        start = cut
+    return windows
+
+def _transcribe_window(backend_name, model_name, options, path, offset):
+    '''Transcribe one audio window in a worker process and shift its timestamps'''
+    result = get_backend(backend_name, model_name, **options).transcribe(path)
+    return [dict(segment, start=segment['start'] + offset, end=segment['end'] + offset) for segment in result['segments']]
+
+def transcribe_audio_parallel(audio_file, workers=PARALLEL_TRANSCRIPTION_WORKERS, backend_name=TRANSCRIPTION_BACKEND, model_name=WHISPER_MODEL,
+                              window_s=PARALLEL_WINDOW_SECONDS, overlap_s=PARALLEL_OVERLAP_SECONDS):
+    '''Transcribe long audio by splitting it into windows transcribed in a process pool'''
+    options = {'threads': max(1, (os.cpu_count() or 1) // workers)}
+    with tempfile.TemporaryDirectory() as out_dir:
+        windows = split_audio(audio_file, out_dir, window_s, overlap_s)
+        print(f"Transcribing {len(windows)} windows with {workers} workers")
+
+        # Spawn so each worker loads its own model without inheriting torch state
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(_transcribe_window, backend_name, model_name, options, path, offset) for path, offset, _, _ in windows]
+            results = [future.result() for future in futures]
+
+    # Stitch the windows, dropping the duplicate segments from the overlaps
+    segments = []
+    for i, ((_, _, keep_from, keep_until), window_segments) in enumerate(zip(windows, results)):
+        if i == len(windows) - 1:
+            keep_until = float('inf')
+        for segment in window_segments:
+            midpoint = (segment['start'] + segment['end']) / 2
+            if keep_from <= midpoint < keep_until:
+                segments.append(segment)
+    return {'text': ''.join(segment['text'] for segment in segments), 'segments': segments}
+
+def get_audio_duration(audio_file):
+    '''Get the duration of an audio file in seconds'''
+    from pydub.utils import mediainfo
+    return float(mediainfo(audio_file).get('duration') or 0)
+
+def transcribe_file(audio_file, backend_name=TRANSCRIPTION_BACKEND, model_name=WHISPER_MODEL):
+    '''Transcribe an audio file, in parallel windows when it is long'''
+    if PARALLEL_TRANSCRIPTION_WORKERS > 1 and get_audio_duration(audio_file) > PARALLEL_TRANSCRIPTION_MIN_SECONDS:
+        return transcribe_audio_parallel(audio_file, backend_name=backend_name, model_name=model_name)
+    return get_backend(backend_name, model_name).transcribe(audio_file)
@@ -5,7 +5,6 @@ from pytube.innertube import _default_clients
 from pydub import AudioSegment
 
 from pytubefix import YouTube
-from pytubefix.cli import on_progress
 
 _default_clients["ANDROID"]["context"]["client"]["clientVersion"] = "19.08.35"
 _default_clients["IOS"]["context"]["client"]["clientVersion"] = "19.08.35"
@@ -57,38 +56,19 @@ def get_throttling_function_name(js: str) -> str:
 cipher.get_throttling_function_name = get_throttling_function_name
 
 
-def download_audio(url, output_path='.'):
-    try:
-        # Use Pytube
-        # # Create a YouTube object 
-        # yt = YouTube(url)
-        
-        # # Get the audio stream
-        # audio_stream = yt.streams.filter(only_audio=True).first()
-        
-        # # Download the audio
-        # output_file = audio_stream.download(output_path=output_path)
-        
-        # # Convert to MP3
-        # name, ext = os.path.splitext(output_file)
-        # new_file = name + '.mp3'
-        # AudioSegment.from_file(output_file).export(new_file, format="mp3")
-        
-        # # Remove the original file
-        # os.remove(output_file)
-        
-        # Use Pytubefix 
-        yt = YouTube(url, on_progress_callback=on_progress)
-        print(yt.title)
-        
-        ys = yt.streams.get_audio_only()
-        new_file = ys.download(mp3=True)
-        
-        print(f"Audio downloaded successfully: {new_file}")
-        return new_file
-        
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
+def get_video_id(url):
+    '''Extract the YouTube video ID from a URL'''
+    match = re.search(r'(?:v=|youtu\.be/|shorts/|embed/|live/)([A-Za-z0-9_-]{11})', url)
+    if match:
+        return match.group(1)
+    raise ValueError(f"Could not extract a YouTube video ID from: {url}")
+
+def download_audio(url):
+    '''Get the audio file of a video from the download cache, downloading it if needed'''
+    from download_manager import get_download_manager
+    new_file = get_download_manager().get_audio(url)
+    print(f"Audio file ready: {new_file}")
+    return new_file
 
 # # Example usage
 # video_url = "https://youtu.be/lH74gNeryhQ?si=B2jVhyzquuwZKnxA"
@@ -1,67 +1,144 @@
-import asyncio
 import streamlit as st
-from video_downloader import download_audio
-from transcribe import load_whisper, transcribe_audio
-from graph_rag import execute_rag_summarization, model_chat
+from video_downloader import download_audio, get_video_id
+from download_manager import DownloadError, get_download_manager
+from transcribe import transcribe_file
+from graph_rag import execute_rag_summarization, model_chat_stream
+from entity_index import EntityIndex
+from chunk_index import ChunkIndex
+from query_cache import get_query_cache
+from storage import VideoStore
+from rag_utils import split_transcript, chunk_records
+from llm_cache import get_model_name
+from streaming_pipeline import run_streaming_pipeline
+from background import get_background_loop, get_job_registry
+from tracing import traced, get_tracer
+from config import STREAMING_PIPELINE, JOB_POLL_SECONDS
 from streamlit_ui import *
 
-from langchain_community.chat_models import ChatOllama
-from langchain_anthropic.chat_models import ChatAnthropic
-from langchain_openai.chat_models import ChatOpenAI
+from models import MODELS, create_llm
 
 
-MODELS = { #model name: requires API key
-    'llama3.1': False,
-    'llama3.2': False,
-    'mistral': False,
-    'gemma2': False,
-    'qwen2.5': False,
-    'claude-3-haiku-20240307': True,
-    'claude-3-5-haiku-20241022': True,
-    'gpt-4o-mini-2024-07-18': True
-}
+@st.cache_resource(show_spinner=False, max_entries=16)
+def get_llm(model, api_key=None):
+    '''Create a model once per model name and API key, so reruns reuse it and its compiled chains'''
+    return create_llm(model, api_key)
 
 def setup_llm(model, api_key=None):
     try:
-        if 'claude' in model:
-            llm = ChatAnthropic(model=model, anthropic_api_key=api_key, max_tokens_to_sample=4096, temperature=0.2)
-        elif 'gpt' in model:
-            llm = ChatOpenAI(model=model, openai_api_key=api_key)
-        else:
-            llm = ChatOllama(model=model)
-        return llm
+        return get_llm(model, api_key)
     
     except Exception as e:
         if api_key:
             st.error(f"Error setting up the model: {e}")
         return None
 
+async def run_video_pipeline(llm, video_url, video_id, on_progress):
+    '''Load or build the transcript and graph of a video on the background loop, returning the session state to apply'''
+    store = VideoStore()
+    background = get_background_loop()
+    model_name = get_model_name(llm) if llm else None
+
+    # A graph missing failed chunks is not stored, so processing the video again retries them from the checkpoints
+    failed = []
+    def track_progress(event):
+        if event['event'] == 'chunk_failed':
+            failed.append(event['chunk_index'])
+        on_progress(event)
+
+    with traced('video', video_id=video_id, model=model_name):
+        # Load stored artifacts for this video
+        video_text = store.load_transcript(video_id)
+        segments = store.load_segments(video_id)
+        result = {"video_text": video_text, "segments": segments}
+        if llm:
+            stored = store.load_graph(video_id, model=model_name)
+            if stored:
+                graph, summary = stored
+                # Videos stored before chunks were saved are re-split from the transcript
+                chunks = store.load_chunks(video_id) or (chunk_records(split_transcript(video_text, segments)) if video_text else [])
+                return dict(result, graph=graph, summary=summary, entity_index=EntityIndex.from_graph(graph), chunk_index=ChunkIndex(chunks))
+
+        # Stream download, transcription and extraction together for new videos
+        if STREAMING_PIPELINE and llm and not video_text:
+            # Reuse cached audio instead of streaming it again
+            source = get_download_manager().cached_path(video_id) or video_url
+            transcript, summary, graph = await run_streaming_pipeline(llm, source, on_progress=track_progress)
+            store.save_transcript(video_id, transcript['text'], segments=transcript['segments'])
+            chunks = chunk_records(split_transcript(transcript['text'], transcript['segments']))
+            if not failed:
+                store.save_graph(video_id, graph, summary, chunks=chunks, model=model_name)
+            return {"video_text": transcript['text'], "segments": transcript['segments'], "graph": graph,
+                    "summary": summary, "entity_index": EntityIndex.from_graph(graph), "chunk_index": ChunkIndex(chunks)}
+
+        # Download and transcribe the audio
+        if not video_text:
+            on_progress({'event': 'stage', 'message': 'Downloading audio ...'})
+            with traced('download', video_id=video_id):
+                audio_file = await background.run_io(download_audio, video_url)
+            on_progress({'event': 'stage', 'message': 'Transcribing audio ...'})
+            with traced('transcription'):
+                transcript = await background.run_cpu(transcribe_file, audio_file)
+            video_text, segments = transcript['text'], transcript['segments']
+            store.save_transcript(video_id, video_text, segments=segments)
+            result = {"video_text": video_text, "segments": segments}
+
+        # Execute GraphRAG
+        if llm:
+            on_progress({'event': 'stage', 'message': 'Summarizing video ...'})
+            summary, graph = await execute_rag_summarization(llm, video_text, on_progress=track_progress, segments=segments)
+            chunks = chunk_records(split_transcript(video_text, segments))
+            if not failed:
+                store.save_graph(video_id, graph, summary, chunks=chunks, model=model_name)
+            result.update(graph=graph, summary=summary, entity_index=EntityIndex.from_graph(graph), chunk_index=ChunkIndex(chunks))
+        return result
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def display_job_progress(job_id):
+    # Poll the background job without rerunning the whole app
+    job = get_job_registry().get(job_id)
+    if job is None or job.done():
+        st.rerun()
+
+    on_progress = display_pipeline_progress()
+    for event in job.events():
+        on_progress(event)
+    if st.button("⏹️ Cancel"):
+        job.cancel()
+
 def process_video(llm, video_url):
-    # Download the audio 
-    if not st.session_state.get("audio_file"):
-        with st.spinner('Downloading Audio ...'):
-            audio_file = download_audio(video_url)
-            print(f"Audio file: {audio_file}")
-            st.session_state["audio_file"] = audio_file
-
-    # Transcribe the audio
-    if not st.session_state.get("video_text"):
-        with st.spinner('Processing Video ...'):
-            whisper_model = load_whisper('turbo')
-            video_text = transcribe_audio(whisper_model, audio_file)
-            st.session_state["video_text"] = video_text
-        
-    # Execute GraphRAG
-    if not st.session_state.get("graph") and llm:
-        with st.spinner('Summarizing video...'):
-            summary, graph = asyncio.run(execute_rag_summarization(llm, video_text))
-
-        st.session_state["graph"] = graph
-        st.session_state["summary"] = summary
-    return  
+    if st.session_state.get("graph") or (st.session_state.get("video_text") and not llm):
+        return
+
+    # Attach to this session's job, or to a job another session started for the same video and model
+    video_id = get_video_id(video_url)
+    key = f"video:{video_id}:{get_model_name(llm) if llm else None}"
+    registry = get_job_registry()
+    job = registry.get(st.session_state.get("job_id"))
+    if job is None or job.key != key:
+        job = registry.submit(key, lambda on_progress: run_video_pipeline(llm, video_url, video_id, on_progress), description=video_url)
+        st.session_state["job_id"] = job.id
+
+    if not job.done():
+        display_job_progress(job.id)
+    elif job.status == 'done':
+        st.session_state.update(job.result)
+    elif job.status == 'failed':
+        if isinstance(job.error, DownloadError):
+            st.error(f"Could not download the video audio: {job.error}")
+        else:
+            st.error(f"Error processing the video: {job.error}")
+    else:
+        st.warning("Processing was cancelled.")
+    return
 
 def process_query(llm, graph, query):
-    response = asyncio.run(model_chat(llm, graph, query=query))
+    # Stream the answer from the shared loop, so chat turns share the scheduler limits with background jobs.
+    # A rerun stops the script mid-stream, which closes the generator and cancels the LLM request.
+    tokens = get_background_loop().iterate(model_chat_stream(llm, graph, query=query, entity_index=st.session_state.get("entity_index"),
+                                                              skip_entity_selection=st.session_state.get("skip_entity_selection", False),
+                                                              query_mode=st.session_state.get("query_mode", "local"),
+                                                              chunk_index=st.session_state.get("chunk_index")))
+    response = display_response_stream(tokens)
     st.session_state["history"].append({"role": "assistant", "content": response})
     return response
 
@@ -75,10 +152,15 @@ def main():
     if model:
         llm = setup_llm(model, st.session_state["api_key"])
 
+    display_query_cache_stats(get_query_cache().stats())
+    display_trace_summary(get_tracer().summary())
+
     # Main content area
-    video_url = display_video_section(api_key_required=MODELS.get(model, True))
+    display_video_section(api_key_required=MODELS.get(model, True))
     
-    if st.session_state.get("video_url"):
+    # The URL is only returned on the run that pressed Process, so reruns read it from the session
+    video_url = st.session_state.get("video_url")
+    if video_url:
         process_video(llm, video_url)
         summary = st.session_state.get("summary")
         if summary:
@@ -88,8 +170,7 @@ def main():
             query = take_user_query()
             if query:
                 with st.spinner('Thinking ...'):
-                    response = process_query(llm, st.session_state["graph"], query)
-                display_response(response)
+                    process_query(llm, st.session_state["graph"], query)
     return
     
 